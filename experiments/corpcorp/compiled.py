@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import glob
+import array
+import datetime
+import numpy as np
+
+from acculturation.lingdistance.jensen_shannon import TOKENIZER
+from acculturation.lingdistance.tokenizers import tokenize_many
+import corpcorp
+
+"""
+Compiled, columnar form of a corpcorp directory.
+
+compile_corpus tokenizes every message once and writes a directory of
+flat arrays, one entry per message, members stored contiguously:
+
+    sender.npy          int32, index into senders.json (-1: no From:)
+    month.npy           int32, year*12 + month-1 (-1: no parseable date)
+    offsets.npy         int64, message i's tokens are tokens[offsets[i]:offsets[i+1]]
+    tokens.npy          int32, index into vocab.json
+    member_offsets.npy  int64, member j's messages are [member_offsets[j], member_offsets[j+1])
+    senders.json, vocab.json, meta.json (members, tokenizer signature)
+
+CompiledCorpus opens the arrays memory-mapped, so opening is instant and
+worker processes share the pages. Its members stand in for
+corpcorp.Member in member_distances: messages keep only the sender, the
+month of the date and the tokens, so segmentation callbacks should only
+look at msg.frm (and msg.date at month resolution).
+
+    python compiled.py <corpcorp dir> <output dir> [workers]
+"""
+
+META = 'meta.json'
+
+
+def compile_corpus(input_dir, output_dir, tokenizer=TOKENIZER, display=False, workers=1):
+    """
+    Compile the *.json member files of input_dir into output_dir,
+    tokenizing with a pool of workers processes if workers > 1.
+    """
+    filenames = sorted(glob.glob(os.path.join(input_dir, "*.json")))
+    vocab = {}
+    senders = {}
+    sender_col = array.array('i')
+    month_col = array.array('i')
+    offsets = array.array('l', [0])
+    tokens = array.array('i')
+    member_offsets = array.array('l', [0])
+    members = []
+    corpus = corpcorp.CorpCorpCorpus(filenames)
+
+    def texts():
+        # Message columns fill in as tokenize_many reads the texts;
+        # the tokens come back in the same order.
+        for member in corpus.iter_members(display=display, stream=True):
+            for msg in member.iter_messages():
+                frm = getattr(msg, 'frm', None)
+                sender_col.append(-1 if frm is None else senders.setdefault(frm, len(senders)))
+                date = msg.date
+                month_col.append(-1 if date is None else date.year * 12 + date.month - 1)
+                yield msg['text']
+            member_offsets.append(len(month_col))
+            members.append((member.username, os.path.basename(member.filename)))
+
+    for words in tokenize_many(texts(), tokenizer, workers=workers):
+        for word in words:
+            tokens.append(vocab.setdefault(word, len(vocab)))
+        offsets.append(len(tokens))
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    for name, col, dtype in (('sender', sender_col, np.int32), ('month', month_col, np.int32),
+                             ('offsets', offsets, np.int64), ('tokens', tokens, np.int32),
+                             ('member_offsets', member_offsets, np.int64)):
+        np.save(os.path.join(output_dir, name + '.npy'), column(col, dtype))
+    for name, table in (('senders', senders), ('vocab', vocab)):
+        with open(os.path.join(output_dir, name + '.json'), 'wb') as outfile:
+            json.dump(sorted(table, key=table.get), outfile)
+    # meta.json last, so a half-written store is never taken for a compiled one
+    with open(os.path.join(output_dir, META), 'wb') as outfile:
+        json.dump({'tokenizer': tokenizer.signature(), 'members': members}, outfile)
+    return CompiledCorpus(output_dir, tokenizer=tokenizer)
+
+
+def column(col, dtype):
+    # array.array to numpy without going element by element
+    if not len(col):
+        return np.zeros(0, dtype=dtype)
+    return np.frombuffer(col, dtype=np.dtype(col.typecode)).astype(dtype)
+
+
+def is_compiled(path):
+    return os.path.isfile(os.path.join(path, META))
+
+
+_opened = {}
+
+def open_compiled(path, tokenizer=TOKENIZER):
+    """CompiledCorpus for path, opened once per process."""
+    key = (os.path.abspath(path), tokenizer.signature())
+    if key not in _opened:
+        _opened[key] = CompiledCorpus(path, tokenizer=tokenizer)
+    return _opened[key]
+
+
+class CompiledCorpus:
+
+    def __init__(self, path, tokenizer=TOKENIZER):
+        self.path = path
+        with open(os.path.join(path, META), 'rb') as infile:
+            meta = json.load(infile)
+        if meta['tokenizer'] != tokenizer.signature():
+            raise ValueError("%s was compiled with different tokenizer settings, recompile it" % path)
+        self.members = meta['members']
+        with open(os.path.join(path, 'vocab.json'), 'rb') as infile:
+            self.vocab = json.load(infile)
+        with open(os.path.join(path, 'senders.json'), 'rb') as infile:
+            self.senders = json.load(infile)
+        load = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        self.sender = load('sender')
+        self.month = load('month')
+        self.offsets = load('offsets')
+        self.tokens = load('tokens')
+        self.member_offsets = load('member_offsets')
+
+    def member(self, i):
+        return CompiledMember(self, i)
+
+    def iter_members(self, display=False):
+        for i in range(len(self.members)):
+            if display:
+                 print (i+1), self.members[i][1]
+            yield self.member(i)
+
+    def iter_messages(self, display=False):
+        for mem in self.iter_members(display=display):
+            for msg in mem.iter_messages():
+                yield msg
+
+    def __len__(self):
+        return len(self.members)
+
+
+class CompiledMember:
+
+    """
+    Read-only stand-in for corpcorp.Member over a CompiledCorpus.
+    Message texts are token id arrays; pass tokenize as the
+    tokenize_fnc of jensen_shannon_distances to turn them into words.
+    """
+
+    def __init__(self, corpus, i):
+        self.corpus = corpus
+        self.username, self.filename = corpus.members[i]
+        self.start = corpus.member_offsets[i]
+        self.stop = corpus.member_offsets[i+1]
+        self.messages = None
+
+    def iter_messages(self):
+        corpus = self.corpus
+        senders = corpus.senders
+        # Pull this member's columns into memory in one go:
+        sender = corpus.sender[self.start:self.stop].tolist()
+        month = corpus.month[self.start:self.stop].tolist()
+        offsets = corpus.offsets[self.start:self.stop+1].tolist()
+        for i in range(len(sender)):
+            yield CompiledMessage(senders[sender[i]] if sender[i] >= 0 else None,
+                                  month_date(month[i]),
+                                  corpus.tokens[offsets[i]:offsets[i+1]])
+
+    def tokenize(self, ids):
+        vocab = self.corpus.vocab
+        return [vocab[i] for i in ids.tolist()]
+
+    def __len__(self):
+        return self.stop - self.start
+
+
+class CompiledMessage(object):
+
+    __slots__ = ('frm', 'date', 'tokens')
+
+    def __init__(self, frm, date, tokens):
+        if frm is not None:
+            self.frm = frm
+        self.date = date
+        self.tokens = tokens
+
+    def timestamp(self):
+        """corpcorp.parse_timestamp of the 1st of the message's month."""
+        return None if self.date is None else corpcorp.datetime_timestamp(self.date)
+
+    def __getitem__(self, key):
+        if key == "text":
+            return self.tokens
+        if hasattr(self, key):
+            return getattr(self, key)
+        return False
+
+
+def month_date(month):
+    """month.npy entry back to a datetime on the 1st of that month."""
+    if month < 0:
+        return None
+    return datetime.datetime(month // 12, month % 12 + 1, 1)
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    compile_corpus(sys.argv[1], sys.argv[2], display=True, workers=workers)
@@ -2,11 +2,13 @@ import os
 import sys
 import datetime
 import re
+import calendar
 import cPickle as pickle
 import json
 import glob
 from collections import defaultdict
 import dateutil.parser
+import dateutil.tz
 
 """
 Objects for wrangling data in the 
@@ -18,15 +20,15 @@ class CorpCorpCorpus:
     def __init__(self, filenames):
         self.filenames = filenames
 
-    def iter_members(self, display=False):
+    def iter_members(self, display=False, stream=False):
         for i, filename in enumerate(self.filenames): 
             if display:
                  print (i+1), filename
-            yield Member(filename)
+            yield Member(filename, stream=stream)
 
     def iter_messages(self, display=False):
-        for mem in self.iter_members(display=display):
-            for msg in mem.messages:
+        for mem in self.iter_members(display=display, stream=True):
+            for msg in mem.iter_messages():
                 yield msg
 
     def __len__(self):
@@ -35,45 +37,182 @@ class CorpCorpCorpus:
 
 class Member:
 
-    def __init__(self, filename):
+    """
+    With stream=True, messages are not loaded up front (self.messages
+    is None); iter_messages() then reads json files one message at a 
+    time, so a mailbox never has to fit in memory all at once.
+    """
+
+    def __init__(self, filename, stream=False):
         self.filename = filename
         self.username = os.path.basename(filename).replace(".p", "").replace(".jsons", "").replace(".json", "")
         self.username = self.username[:self.username.rfind("_")]
+        self.messages = None
+        if not stream:
+            with open(self.filename, 'rb') as infile:
+                if self.is_json():
+                    msgs = json.loads(infile.read())
+                else:
+                    msgs = pickle.load(infile)
+            self.messages = [Message(m) for m in msgs]
+
+    def is_json(self):
+        return self.filename.endswith('.jsons') or self.filename.endswith(".json")
+
+    def iter_messages(self):
+        if self.messages is not None:
+            for msg in self.messages:
+                yield msg
+            return
         with open(self.filename, 'rb') as infile:
-            if self.filename.endswith('.jsons') or self.filename.endswith(".json"):
-                msgs = json.loads(infile.read())
+            if self.is_json():
+                msgs = iter_json_array(infile)
             else:
+                # No incremental pickle reading, load as usual
                 msgs = pickle.load(infile)
-        self.messages = [Message(m) for m in msgs]
+            for m in msgs:
+                yield Message(m)
 
     def __len__(self):
+        if self.messages is None:
+            return sum(1 for _ in self.iter_messages())
         return len(self.messages)
 
+
+def iter_json_array(infile, chunksize=2**16):
+    """
+    Yield the elements of the json array in infile one at a time,
+    reading chunksize bytes at a time rather than the whole file.
+    """
+    decoder = json.JSONDecoder()
+    name = getattr(infile, 'name', infile)
+    buf, pos, eof = '', 0, False
+    started = False
+    readsize = chunksize
+    while True:
+        # Skip whitespace and the array punctuation between elements
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError("Truncated json array in %s" % name)
+            chunk = infile.read(readsize)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+            continue
+        c = buf[pos]
+        if not started:
+            if c != '[':
+                raise ValueError("Expected a json array in %s" % name)
+            started = True
+            pos += 1
+        elif c == ']':
+            return
+        elif c == ',':
+            pos += 1
+        else:
+            # Decode one element. Unless it is followed by a ',' or ']' it 
+            # may have been cut short (e.g. a number) or not decode at all, 
+            # so read more and retry, doubling the read size so huge 
+            # elements aren't re-parsed chunk by chunk.
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+                after = buf[end:end+1024].lstrip(' \t\r\n')[:1]
+                complete = eof or (after and after in ',]')
+            except ValueError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                chunk = infile.read(readsize)
+                buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+                readsize *= 2
+                continue
+            readsize = chunksize
+            pos = end
+            yield element
+
                                 
-class Message:
+class Message(object):
 
     """
-    Initialization sets these attributes:
+    Wraps one message dict from a member file. Exposes these attributes,
+    decoded only when first accessed:
     
     'body', 'x-gmail-labels', 'delivered-to', 'from',
     'sender', 'cc', 'bcc', 'to', 'references',
     'in-reply-to', 'date', 'reply-to',
     'message-id', 'importance', 'subject'
+
+    As attributes, dashes become underscores and 'from' becomes 'frm'.
+    'date' is a datetime (None if unparseable) and 'to', 'cc' and 'bcc'
+    are lists of addresses.
     """    
+
+    __slots__ = ('_raw', '_decoded')
     
     def __init__(self, m):
-        for key, val in m.items():
-            key = key.replace("-", "_")
-            if key == 'date':
-                try:
-                    val = dateutil.parser.parse(val)
-                except:
-                    val = None
-            elif key in ('to', 'cc', 'bcc') and val:
-                val = [x.strip(',').strip() for x in val.splitlines()]
-            elif key == 'from':
-                key = 'frm'
-            setattr(self, key, val)
+        self._raw = m
+        self._decoded = None
+
+    def __getattr__(self, name):
+        # Only called for names not found the usual way, i.e. headers
+        if name.startswith('__'):
+            raise AttributeError(name)
+        decoded = self._decoded
+        if decoded is not None and name in decoded:
+            return decoded[name]
+        key = self._raw_key(name)
+        if key is None:
+            raise AttributeError(name)
+        val = self._raw[key]
+        if name == 'date':
+            val = parse_date(val)
+        elif name in ('to', 'cc', 'bcc') and val:
+            val = [x.strip(',').strip() for x in val.splitlines()]
+        else:
+            # Plain header, nothing worth caching
+            return val
+        if decoded is None:
+            decoded = self._decoded = {}
+        decoded[name] = val
+        return val
+
+    def __setattr__(self, name, val):
+        if name in Message.__slots__:
+            object.__setattr__(self, name, val)
+        else:
+            if self._decoded is None:
+                self._decoded = {}
+            self._decoded[name] = val
+
+    def _raw_key(self, name):
+        raw = self._raw
+        if name == 'frm':
+            return 'from' if 'from' in raw else None
+        if name == 'from':
+            return None
+        if name in raw:
+            return name
+        if name.replace("_", "-") in raw:
+            return name.replace("_", "-")
+        for key in raw:
+            if key.replace("-", "_") == name and key != 'from':
+                return key
+        return None
+
+    def timestamp(self):
+        """parse_timestamp of the Date: header, None if missing or unparseable."""
+        if self._decoded is not None and 'date' in self._decoded:
+            date = self._decoded['date']
+            return None if date is None else datetime_timestamp(date)
+        key = self._raw_key('date')
+        return None if key is None else parse_timestamp(self._raw[key])
+
+    def __getstate__(self):
+        return self._raw, self._decoded
+
+    def __setstate__(self, state):
+        self._raw, self._decoded = state
             
     def __getitem__(self, key):
         # Want to let users index into Message
@@ -85,3 +224,87 @@ class Message:
             return getattr(self, key)
         return False
 
+
+# Fast path for the usual RFC 2822 Date: header, e.g.
+#   Mon, 5 Jan 2001 10:00:00 -0700
+rfc2822_date_re = re.compile(r"""
+    ^(?:(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun),\s)?
+    (\d{1,2})\s(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s(\d{4})\s
+    (\d{2}):(\d{2})(?::(\d{2}))?\s
+    ([+-])(\d{2})(\d{2})$""", re.VERBOSE)
+
+MONTHS = {m: i+1 for i, m in enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                                         'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'))}
+
+def parse_date(val):
+    """
+    Date header to datetime, or None if it can't be parsed. Headers of
+    the common RFC 2822 shape skip dateutil, which is much slower, and
+    give an equal datetime with the same UTC offset.
+    """
+    match = rfc2822_date_re.match(val) if isinstance(val, basestring) else None
+    if match:
+        day, month, year, hour, minute, second, sign, tzh, tzm = match.groups()
+        offset = (int(tzh) * 3600 + int(tzm) * 60) * (-1 if sign == '-' else 1)
+        tzinfo = dateutil.tz.tzutc() if offset == 0 else dateutil.tz.tzoffset(None, offset)
+        try:
+            return datetime.datetime(int(year), MONTHS[month], int(day), int(hour), int(minute),
+                                     int(second or 0), tzinfo=tzinfo)
+        except ValueError:
+            pass
+    try:
+        return dateutil.parser.parse(val)
+    except:
+        return None
+
+
+def parse_timestamp(val):
+    """
+    Date header to seconds since 1970-01-01 in the header's own local
+    time (as if its clock time were UTC), so that the calendar month of
+    the timestamp is that of parse_date(val); None if it can't be
+    parsed. Headers of the common RFC 2822 shape are done in integer
+    arithmetic, without building a datetime.
+    """
+    match = rfc2822_date_re.match(val) if isinstance(val, basestring) else None
+    if match:
+        day, month, year, hour, minute, second = match.groups()[:6]
+        day, month, year = int(day), MONTHS[month], int(year)
+        hour, minute, second = int(hour), int(minute), int(second or 0)
+        # Whatever datetime() would reject goes to parse_date as well:
+        if year >= 1 and 1 <= day <= calendar.monthrange(year, month)[1] \
+                and hour < 24 and minute < 60 and second < 60:
+            return days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second
+    date = parse_date(val)
+    return None if date is None else datetime_timestamp(date)
+
+
+def datetime_timestamp(date):
+    """A datetime's parse_timestamp: its clock time in seconds since 1970-01-01."""
+    return days_from_civil(date.year, date.month, date.day) * 86400 + \
+        date.hour * 3600 + date.minute * 60 + date.second
+
+
+# Conversions between (year, month, day) and days since 1970-01-01 in the
+# proleptic Gregorian calendar, with integer operations only, so they work
+# on ints and elementwise on numpy integer arrays alike. After
+# http://howardhinnant.github.io/date_algorithms.html
+
+def days_from_civil(year, month, day):
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+def civil_from_days(days):
+    days = days + 719468
+    era = days // 146097
+    doe = days - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = (mp + 2) % 12 + 1
+    return yoe + era * 400 + (month <= 2), month, day
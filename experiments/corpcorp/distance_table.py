@@ -0,0 +1,217 @@
+import json
+import array
+import numpy as np
+
+"""
+Columnar table of monthly distances.
+
+get_monthly_distances(columnar=True) and
+distances_from_segment_counts(monthly=True, columnar=True) return a
+MonthlyDistances rather than {user: {(YYYY, MM): {segment: d}}}: one row
+per (user, month, segment), held in flat numpy arrays
+
+    user         int32, index into users
+    year         int16
+    month        int8, 1-12
+    segment      int32, index into segments
+    distance     float64, JS distance between the user and the segment
+    member_size  int32, the user's own messages that month (-1: unknown)
+    size         int32, the segment's messages that month (-1: unknown)
+
+with rows sorted by user, year, month and segment. save writes the
+arrays to one .npz file, and the group-by helpers (group_means,
+user_means, trajectories) work on the arrays rather than on dicts.
+
+    table = get_monthly_distances(input_dir, columnar=True)
+    table.save('months.npz')
+    means = load_monthly_distances('months.npz').user_means()
+"""
+
+COLUMNS = (('user', np.int32), ('year', np.int16), ('month', np.int8), ('segment', np.int32),
+           ('distance', np.float64), ('member_size', np.int32), ('size', np.int32))
+
+# array.array typecodes the columns are collected in, before conversion:
+TYPECODES = {'user': 'i', 'year': 'h', 'month': 'b', 'segment': 'i',
+             'distance': 'd', 'member_size': 'i', 'size': 'i'}
+
+
+def monthly_table(member_results):
+    """
+    MonthlyDistances from (username, monthly_distances, sizes) triples,
+    monthly_distances as a member's entry in get_monthly_distances and
+    sizes mapping (month, segment) to numbers of messages, as in
+    get_segment_counts (or None if unknown).
+    """
+    users = {}
+    segments = {}
+    cols = {name: array.array(TYPECODES[name]) for name, dtype in COLUMNS}
+    for username, monthly_distances, sizes in member_results:
+        user = users.setdefault(username, len(users))
+        sizes = sizes or {}
+        for (year, month), distances in monthly_distances.iteritems():
+            member_size = sizes.get(((year, month), username), -1)
+            for seg, d in distances.iteritems():
+                cols['user'].append(user)
+                cols['year'].append(year)
+                cols['month'].append(month)
+                cols['segment'].append(segments.setdefault(seg, len(segments)))
+                cols['distance'].append(d)
+                cols['member_size'].append(member_size)
+                cols['size'].append(sizes.get(((year, month), seg), -1))
+    columns = {}
+    for name, dtype in COLUMNS:
+        col = cols[name]
+        columns[name] = np.frombuffer(col, dtype=np.dtype(col.typecode)).astype(dtype) if len(col) \
+            else np.zeros(0, dtype=dtype)
+    table = MonthlyDistances(sorted(users, key=users.get), sorted(segments, key=segments.get), columns)
+    # Segment ids in name order, so that tables of the same results compare equal:
+    return table.sorted()
+
+
+def load_monthly_distances(filename):
+    """MonthlyDistances written by MonthlyDistances.save."""
+    with np.load(filename) as npz:
+        names = json.loads(npz['names'].item())
+        return MonthlyDistances(names['users'], names['segments'],
+                                {name: npz[name] for name, dtype in COLUMNS})
+
+
+class MonthlyDistances:
+
+    def __init__(self, users, segments, columns):
+        """
+        users, segments- the names the user and segment columns index
+        columns- dict of the arrays in COLUMNS, of equal length
+        """
+        self.users = list(users)
+        self.segments = list(segments)
+        for name, dtype in COLUMNS:
+            setattr(self, name, np.asarray(columns[name], dtype=dtype))
+
+    def __len__(self):
+        return len(self.distance)
+
+    def columns(self):
+        return {name: getattr(self, name) for name, dtype in COLUMNS}
+
+    def sorted(self):
+        """
+        This table with users and segments renumbered in sorted name
+        order, and rows sorted by user, year, month and segment.
+        """
+        users = sorted(self.users)
+        segments = sorted(self.segments)
+        columns = self.columns()
+        columns['user'] = rank_of(self.users, users)[self.user]
+        columns['segment'] = rank_of(self.segments, segments)[self.segment]
+        order = np.lexsort((columns['segment'], columns['month'], columns['year'], columns['user']))
+        return MonthlyDistances(users, segments, {name: col[order] for name, col in columns.iteritems()})
+
+    def select(self, mask):
+        """The rows where the boolean array mask is true."""
+        return MonthlyDistances(self.users, self.segments,
+                                {name: col[mask] for name, col in self.columns().iteritems()})
+
+    def user_mask(self, usernames):
+        """Boolean array, true for the rows of the users in usernames."""
+        wanted = np.array([user in usernames for user in self.users] + [False], dtype=bool)
+        return wanted[self.user]
+
+    def segment_rows(self, segment):
+        """The rows of distances to the named segment, e.g. "other"."""
+        if segment not in self.segments:
+            return self.select(np.zeros(len(self), dtype=bool))
+        return self.select(self.segment == self.segments.index(segment))
+
+    def month_index(self):
+        """year*12 + month-1 of each row, as in compiled.py."""
+        return self.year.astype(np.int64) * 12 + self.month - 1
+
+    def save(self, filename):
+        """Write the table to filename as an uncompressed .npz."""
+        names = json.dumps({'users': self.users, 'segments': self.segments})
+        # (a file object, so that numpy doesn't add .npz to the name)
+        with open(filename, 'wb') as outfile:
+            np.savez(outfile, names=np.array(names), **self.columns())
+
+    def to_dict(self):
+        """
+        The nested {user: {(YYYY, MM): {segment: d}}} of get_monthly_distances,
+        except that the table only has rows for distances: a month whose
+        segments were all dropped (min_segment_size), which
+        get_monthly_distances gives as {}, is missing here, and so is a
+        user whose months were all empty.
+        """
+        nested = {}
+        for user, year, month, seg, d in zip(self.user.tolist(), self.year.tolist(), self.month.tolist(),
+                                             self.segment.tolist(), self.distance.tolist()):
+            nested.setdefault(self.users[user], {}).setdefault((year, month), {})[self.segments[seg]] = d
+        return nested
+
+    ######################################################################
+
+    def group_means(self, keys=('user', 'year', 'month')):
+        """
+        Mean distance over the rows of each distinct combination of the
+        key columns.
+
+        return value:
+            dict mapping each of keys to the group's values (groups in
+            sorted order), 'distance' to the means and 'count' to the
+            number of rows averaged
+        """
+        cols = [getattr(self, key).astype(np.int64) for key in keys]
+        if not len(self):
+            groups = {key: col for key, col in zip(keys, cols)}
+            groups.update(distance=np.zeros(0), count=np.zeros(0, dtype=np.int64))
+            return groups
+        order = np.lexsort(cols[::-1])
+        cols = [col[order] for col in cols]
+        # Start of each run of equal keys:
+        starts = np.flatnonzero(np.concatenate([[True], np.any([np.diff(col) != 0 for col in cols], axis=0)]))
+        counts = np.diff(np.append(starts, len(order)))
+        groups = {key: col[starts] for key, col in zip(keys, cols)}
+        groups['distance'] = np.add.reduceat(self.distance[order], starts) / counts
+        groups['count'] = counts
+        return groups
+
+    def user_monthly_means(self):
+        """group_means by user and month: a user's mean distance to its segments each month."""
+        return self.group_means(('user', 'year', 'month'))
+
+    def user_means(self, min_months=1):
+        """
+        {username: mean of its monthly means}, for users with distances
+        for at least min_months months.
+        """
+        monthly = self.user_monthly_means()
+        nmonths = np.bincount(monthly['user'], minlength=len(self.users))
+        sums = np.bincount(monthly['user'], weights=monthly['distance'], minlength=len(self.users))
+        keep = np.flatnonzero(nmonths >= max(min_months, 1))
+        return {self.users[u]: m for u, m in zip(keep.tolist(), (sums[keep] / nmonths[keep]).tolist())}
+
+    def trajectories(self, min_months=1, max_months=None):
+        """
+        Each user's monthly means in month order, for users with between
+        min_months and max_months months.
+
+        return value:
+            {username: (array of months as in month_index, array of
+            monthly means)}
+        """
+        monthly = self.user_monthly_means()
+        months = monthly['year'] * 12 + monthly['month'] - 1
+        # user_monthly_means is sorted by user, so each user is one run:
+        bounds = np.searchsorted(monthly['user'], np.arange(len(self.users) + 1))
+        trajectories = {}
+        for u in range(len(self.users)):
+            start, stop = bounds[u], bounds[u + 1]
+            if stop - start >= max(min_months, 1) and (max_months is None or stop - start <= max_months):
+                trajectories[self.users[u]] = (months[start:stop], monthly['distance'][start:stop])
+        return trajectories
+
+
+def rank_of(names, sorted_names):
+    """Array mapping positions in names to positions in sorted_names."""
+    positions = {name: i for i, name in enumerate(sorted_names)}
+    return np.array([positions[name] for name in names], dtype=np.int64)
@@ -3,15 +3,33 @@ import os
 
 from acculturation.experiments import corpcorp
 from acculturation.experiments.corpcorp.member_distances import get_userlevel_distances
+from acculturation.experiments.corpcorp.member_distances import get_segment_counts, distances_from_segment_counts
+from acculturation.experiments.corpcorp.member_distances import sweep_distances
+from acculturation.experiments.corpcorp.member_distances import get_userlevel_segmentation_fnc
 
 # Directory path to pickled or json files.
 DIRNAME = None
 
+# Usernames of the members who left; everyone else counts as 'living':
+DEPARTED = set()
+
+# Every experiment below re-reads the same DIRNAME, so keep tokenized
+# messages in sidecar files and only tokenize the corpus once:
+TOKEN_CACHE = True
+
+# Full per-segment count tables, kept between runs:
+COUNTS_FILE = 'userlevel_counts.pickle'
+
+# Tokenize the corpus once, counting terms by user-level segment and month;
+# all the unsampled experiments below, monthly or not, are derived from these:
+userlevel_counts = get_segment_counts(DIRNAME, get_userlevel_segmentation_fnc, token_cache=TOKEN_CACHE,
+                                      counts_file=COUNTS_FILE)
+
 ######################################################################
 # User-level experiments, no monthly breakdown:
 
 # The central experiment, I'd say: LIWC mapping, all people in the data, all words no breakdown by time:
-users_liwc = get_userlevel_distances(DIRNAME, sampling=False, liwc_map=True)
+users_liwc = distances_from_segment_counts(userlevel_counts, liwc_map=True)
 
 # Basic plot with stat test:
 corpcorp.plots.plot_js_distances(users_liwc)
@@ -30,38 +48,48 @@ corpcorp.plots.plot_js_distances(users_liwc, sampsize=get_min_length(users_liwc)
 corpcorp.plots.plot_js_distances(users_liwc, sampsize=get_half_of_min_length(users_liwc))
 
 # Variation on the user-level experiment: no LIWC mapping, sample 1000 vocab items, keep all users:
-users_vocab1000 = get_userlevel_distances(DIRNAME, sampling=False, liwc_map=False, vocabsize=1000)
+users_vocab1000 = distances_from_segment_counts(userlevel_counts, liwc_map=False, vocabsize=1000)
+
+# Robustness to vocabulary size, with and without LIWC, from the same counts:
+users_vocab_sweep = sweep_distances(userlevel_counts, vocabsizes=(100, 500, 1000, 5000))
 
 # Variation on the user-level experiment: LIWC mapping, all words, sample 1000 users
-users_liwc_interlocutors1000 = get_userlevel_distances(DIRNAME, sampling=True, sampsize=1000, liwc_map=True)
+users_liwc_interlocutors1000 = get_userlevel_distances(DIRNAME, sampling=True, sampsize=1000, liwc_map=True, token_cache=TOKEN_CACHE)
 
 ######################################################################
 # Monthly breakdown
 
 # The central temporal experiment: LIWC mapping, all people in the data, distances taken by month,
 # minimum of 20 messages per user per month
-months_liwc = get_userlevel_distances(DIRNAME, monthly=True, min_segment_size=20, liwc_map=True)
+# (as distance_table.MonthlyDistances, saved in a binary file)
+months_liwc = distances_from_segment_counts(userlevel_counts, monthly=True, min_segment_size=20, liwc_map=True,
+                                            columnar=True)
+months_liwc.save('months_liwc.npz')
 
 # Variation on the temporal experiment: no LIWC mapping, all people in the data, distances taken by month:
-months = get_userlevel_distances(DIRNAME, monthly=True, min_segment_size=20, liwc_map=False)
+months = distances_from_segment_counts(userlevel_counts, monthly=True, min_segment_size=20, liwc_map=False,
+                                       columnar=True)
+
+def split_by_group(table):
+    # The rows of the living and of the departed members, as separate tables
+    departed = table.user_mask(DEPARTED)
+    return {'living': table.select(~departed), 'departed': table.select(departed)}
 
 def get_monthy_means(monthly):
-    monthly_means = defaultdict(dict)
-    for key in ('living', 'departed'):
-        for u, date_dict in monthly[key].items(): 
-            if date_dict: # Keep only users for whom we have at least one monthly estimate.
-                monthly_means[key][u] = np.mean(np.array(date_dict.values()))
-    return monthly_means
+    # Keep only users for whom we have at least one monthly estimate.
+    return {key: monthly[key].user_means(min_months=1) for key in ('living', 'departed')}
+
+months_liwc_groups = split_by_group(months_liwc)
 
 # Plot monthly averages:
 corpcorp.plots.plot_js_distances(
-    get_monthy_means(months_liwc),
+    get_monthy_means(months_liwc_groups),
     title="Mean monthly linguistic distance from one's email interlocutors",
     ylabel="Mean monthly Jensen-Shannon distance")
 
 # Try plotting trajectories:
 corpcorp.plots.plot_trajectories(
-    months_liwc['departed'],
+    months_liwc_groups['departed'],
     min_months=4,
     max_months=12,
     zscore=False,
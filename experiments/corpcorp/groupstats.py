@@ -0,0 +1,255 @@
+import numpy as np
+from scipy.stats import norm, rankdata
+
+"""
+Group comparisons for plots.py, without matplotlib, so that they can run
+headless in batch jobs.
+
+Every test works on rows: x is a (B, n1) and y a (B, n2) array, one
+pair of samples per row, and the result is an array of B statistics.
+That way a few thousand permutations, bootstrap resamples or subsamples
+cost a handful of numpy calls rather than a scipy call each.
+
+    stats = compare_groups(living, departed, permutations=1000, bootstrap=1000)
+    print test_report(stats)
+"""
+
+# Resampled values materialized at a time (rows x row width), to bound
+# the memory of a chunk of resamples:
+CHUNK_VALUES = 2 ** 22
+
+
+def mann_whitney_u(x, y):
+    """
+    U statistic of x against y, the number of (x, y) pairs with x > y,
+    ties counting 1/2, for each row of x and y; and the tie term
+    sum(t**3 - t) over the groups of t tied values in each row.
+    """
+    x = np.atleast_2d(x)
+    y = np.atleast_2d(y)
+    rows, n1 = x.shape
+    n2 = y.shape[1]
+    # Values to integer codes, shifted by row so that one sorted array
+    # holds the y codes of all rows, row after row:
+    values, codes = np.unique(np.concatenate([x, y], axis=1), return_inverse=True)
+    codes = codes.reshape(rows, n1 + n2) + np.arange(rows)[:, None] * len(values)
+    ycodes = np.sort(codes[:, n1:], axis=None)
+    xcodes = codes[:, :n1]
+    below = np.searchsorted(ycodes, xcodes, 'left')
+    upto = np.searchsorted(ycodes, xcodes, 'right')
+    u = (below - np.arange(rows)[:, None] * n2).sum(axis=1) + 0.5 * (upto - below).sum(axis=1)
+    tied, counts = np.unique(codes, return_counts=True)
+    ties = np.bincount(tied // len(values), weights=counts ** 3.0 - counts, minlength=rows)
+    return u, ties
+
+
+def coded_u(xcodes, ycodes, ncodes):
+    """
+    mann_whitney_u for rows of integer codes in range(ncodes) standing
+    for values in sorted order (resamples of the same pooled values).
+    Unless there are more codes than values in a row, it counts each
+    row's codes rather than sorting them.
+    """
+    if ncodes > xcodes.shape[1] + ycodes.shape[1]:
+        return mann_whitney_u(xcodes, ycodes)
+    xcounts = row_counts(xcodes, ncodes)
+    ycounts = row_counts(ycodes, ncodes)
+    # y values below each code, plus half of those equal to it:
+    beaten = np.cumsum(ycounts, axis=1) - 0.5 * ycounts
+    u = (xcounts * beaten).sum(axis=1)
+    tied = xcounts + ycounts
+    return u, (tied ** 3 - tied).sum(axis=1)
+
+
+def row_counts(codes, ncodes):
+    """(rows, ncodes) array of how often each code occurs in each row."""
+    rows = codes.shape[0]
+    shifted = codes + np.arange(rows)[:, None] * ncodes
+    return np.bincount(shifted.ravel(), minlength=rows * ncodes).reshape(rows, ncodes).astype(np.float64)
+
+
+def u_test(x, y, use_continuity=True):
+    """
+    Two-sided Mann-Whitney U test of each row of x against the same row
+    of y, with the normal approximation and tie correction of
+    scipy.stats.mannwhitneyu(alternative='two-sided').
+
+    return value:
+        (U, p-values, effect sizes) arrays, the effect size being the
+        common-language effect size U / (n1 * n2), the probability that
+        a value of x exceeds one of y (ties counting 1/2).
+    """
+    x = np.atleast_2d(x)
+    y = np.atleast_2d(y)
+    u, ties = mann_whitney_u(x, y)
+    return u_pvalues(u, ties, x.shape[1], y.shape[1], use_continuity)
+
+
+def u_pvalues(u, ties, n1, n2, use_continuity=True):
+    # (U, p-values, effect sizes) from U and tie terms, as u_test
+    n = n1 + n2
+    mean = n1 * n2 / 2.0
+    sd = np.sqrt(n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1.0))))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (np.abs(u - mean) - 0.5 * use_continuity) / sd
+    pvals = np.where(sd > 0, np.minimum(2 * norm.sf(np.abs(z)), 1.0), 1.0)
+    return u, pvals, u / float(n1 * n2)
+
+######################################################################
+
+def pooled_codes(x, y):
+    """
+    Codes of the values of x and y for coded_u (their positions among
+    the distinct values of both), and the number of distinct values.
+    """
+    values, codes = np.unique(np.concatenate([x, y]), return_inverse=True)
+    return codes[:len(x)], codes[len(x):], len(values)
+
+
+def resample(values, size, resamples, rng, replace=True):
+    """
+    (resamples, size) array of draws from values, with replacement
+    (bootstrap) or without (subsampling).
+    """
+    values = np.asarray(values)
+    if replace:
+        return values[rng.randint(0, len(values), (resamples, size))]
+    # The values with the size smallest of a row of random keys:
+    keys = rng.rand(resamples, len(values))
+    if size < len(values):
+        return values[np.argpartition(keys, size - 1, axis=1)[:, :size]]
+    return values[np.argsort(keys, axis=1)]
+
+
+def chunks(total, width):
+    """Sizes of the chunks of total rows of width values each."""
+    chunksize = max(1, CHUNK_VALUES // max(width, 1))
+    return [min(chunksize, total - i) for i in range(0, total, chunksize)]
+
+
+def permutation_pvalue(x, y, permutations=1000, seed=0):
+    """
+    Two-sided permutation p-value of U: the share of relabellings of the
+    pooled values whose U is at least as far from n1*n2/2 as the observed
+    one, counting the observed labelling as one of them.
+    """
+    rng = np.random.RandomState(seed)
+    n1, n2 = len(x), len(y)
+    # A relabelling's U is the sum of the ranks given the x label, minus
+    # n1*(n1+1)/2; the pooled ranks themselves never change.
+    ranks = rankdata(np.concatenate([x, y]))
+    offset = n1 * (n1 + 1) / 2.0
+    mean = n1 * n2 / 2.0
+    observed = np.abs(ranks[:n1].sum() - offset - mean)
+    extreme = 0
+    for size in chunks(permutations, n1 + n2):
+        u = resample(ranks, n1, size, rng, replace=False).sum(axis=1) - offset
+        # U moves in steps of 1/2, so this tolerance only absorbs rounding:
+        extreme += np.count_nonzero(np.abs(u - mean) >= observed - 1e-9)
+    return (extreme + 1.0) / (permutations + 1.0)
+
+
+def bootstrap_effect(x, y, resamples=1000, seed=0, ci=95):
+    """
+    Bootstrap distribution of the effect size, each group resampled
+    with replacement to its own size.
+
+    return value:
+        ((low, high) percentile interval covering ci percent, two-sided
+        bootstrap p-value for an effect size of 1/2)
+    """
+    rng = np.random.RandomState(seed)
+    xcodes, ycodes, ncodes = pooled_codes(x, y)
+    effects = []
+    for size in chunks(resamples, len(x) + len(y) + ncodes):
+        u, ties = coded_u(resample(xcodes, len(x), size, rng), resample(ycodes, len(y), size, rng), ncodes)
+        effects.append(u / float(len(x) * len(y)))
+    effects = np.concatenate(effects)
+    interval = tuple(np.percentile(effects, [(100 - ci) / 2.0, (100 + ci) / 2.0]))
+    pval = min(1.0, 2 * min(np.mean(effects <= 0.5), np.mean(effects >= 0.5)))
+    return interval, pval
+
+
+def subsample_tests(x, y, sampsize, resamples=1000, seed=0):
+    """
+    u_test on resamples subsamples of sampsize values of each group
+    (or all of a group's values, if it has fewer).
+    """
+    rng = np.random.RandomState(seed)
+    xcodes, ycodes, ncodes = pooled_codes(x, y)
+    n1, n2 = min(sampsize, len(x)), min(sampsize, len(y))
+    results = []
+    for size in chunks(resamples, len(x) + len(y)):
+        u, ties = coded_u(resample(xcodes, n1, size, rng, replace=False),
+                          resample(ycodes, n2, size, rng, replace=False), ncodes)
+        results.append(u_pvalues(u, ties, n1, n2))
+    return tuple(np.concatenate(arrays) for arrays in zip(*results))
+
+######################################################################
+
+def compare_groups(x, y, sampsize=None, resamples=1000, permutations=0, bootstrap=0, seed=0):
+    """
+    Mann-Whitney comparison of the values x and y.
+
+    kargs:
+        sampsize- if an int, test resamples subsamples of sampsize values
+            from each group, and report the median U and p-value over them.
+        permutations- if nonzero, add a permutation p-value from this many
+            relabellings.
+        bootstrap- if nonzero, add a 95% interval for the effect size and
+            a bootstrap p-value from this many resamples.
+        seed- seed of the numpy RandomStates drawing the resamples.
+
+    return value:
+        dict with n1, n2, u, pval and effect, and permutation_pval,
+        effect_ci and bootstrap_pval as requested.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    stats = {'n1': len(x), 'n2': len(y)}
+    if sampsize:
+        u, pvals, effects = subsample_tests(x, y, sampsize, resamples=resamples, seed=seed)
+        stats['sampsize'] = sampsize
+        stats.update(u=np.median(u), pval=np.median(pvals), effect=np.median(effects))
+    else:
+        u, pvals, effects = u_test(x, y)
+        stats.update(u=u[0], pval=pvals[0], effect=effects[0])
+    if permutations:
+        stats['permutation_pval'] = permutation_pvalue(x, y, permutations=permutations, seed=seed)
+    if bootstrap:
+        stats['effect_ci'], stats['bootstrap_pval'] = bootstrap_effect(x, y, resamples=bootstrap, seed=seed)
+    return stats
+
+
+def format_pval(pval):
+    # Avoid printing spurious and impossible 0.0 p values:
+    pval = np.round(pval, 4)
+    if pval == 0.0:
+        return "p < 0.001"
+    return "p = %s" % pval
+
+
+def test_report(stats):
+    """One-line summary of a compare_groups result."""
+    report = "Mann-Whitney U = %s; %s" % (stats['u'], format_pval(stats['pval']))
+    if 'sampsize' in stats:
+        report += " (median of subsamples of %s)" % stats['sampsize']
+    report += "; P(X > Y) = %.3f" % stats['effect']
+    if 'effect_ci' in stats:
+        report += " [%.3f, %.3f]" % stats['effect_ci']
+    if 'permutation_pval' in stats:
+        report += "; permutation %s" % format_pval(stats['permutation_pval'])
+    if 'bootstrap_pval' in stats:
+        report += "; bootstrap %s" % format_pval(stats['bootstrap_pval'])
+    return report
+
+######################################################################
+
+def density_bins(vals, bins=40):
+    """
+    Shared bin edges over all groups in vals, and each group's histogram
+    as a share of its size, for the binned rendering of large groups.
+    """
+    edges = np.histogram(np.concatenate(vals), bins=bins)[1]
+    shares = [np.histogram(v, bins=edges)[0] / float(max(len(v), 1)) for v in vals]
+    return edges, shares
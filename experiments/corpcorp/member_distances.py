@@ -1,12 +1,26 @@
 
 import os
+import copy
+import hashlib
+import zlib
+import logging
+import traceback
 import sys
 import cPickle
 import glob
-from collections import defaultdict
-
-from acculturation.lingdistance.jensen_shannon import jensen_shannon_distances
+import itertools
+import multiprocessing
+from collections import defaultdict, Counter
+
+from acculturation.lingdistance.jensen_shannon import jensen_shannon_distances, TOKENIZER, get_liwc_index
+from acculturation.lingdistance.jensen_shannon import segment_term_counts, distances_from_counts, global_vocabulary
+from acculturation.lingdistance.tokencache import TokenCache
+from acculturation.lingdistance.resampling import MessageCounts, resampled_distances
 import corpcorp
+import compiled
+import distance_table
+import windows
+from senders import SENDERS
 
 
 """
@@ -48,8 +62,11 @@ def get_dyadic_distances(input_dir, monthly=False, **get_distances_kargs):
     Wrapper around get_distances. For get_distances_kargs, see get_distances documentation.
 
     This fnc just sets a default for get_member_message_segmentation_fnc
-    and chooses between get_distances and get_monthly_distances for you
+    and chooses between get_distances and get_monthly_distances for you.
+    Members have many interlocuters here, so all-pairs distances are
+    computed in matrix mode unless matrix=False is passed.
     """
+    get_distances_kargs.setdefault('matrix', True)
     if monthly:
         distances = get_monthly_distances(input_dir, 
                         get_member_message_segmentation_fnc=get_dyadic_segmentation_fnc, 
@@ -66,12 +83,15 @@ def get_dyadic_distances(input_dir, monthly=False, **get_distances_kargs):
 def get_distances(input_dir, get_member_message_segmentation_fnc=None,
                                 liwc_map=False, vocabsize=1000,
                                 sampling=False, sampsize=1000,
-                                min_segment_size=5):
+                                min_segment_size=5, matrix=False,
+                                workers=1, token_cache=False, stream=False,
+                                checkpoint=None):
     """
     Measures JS distances for an input_dir of corpcorp.Member json files
 
     args:
-        input_dir- where all the *.json email files live
+        input_dir- where all the *.json email files live,
+            or a store written by compiled.compile_corpus
 
     kargs:
         get_member_message_segmentation_fnc- 
@@ -86,6 +106,24 @@ def get_distances(input_dir, get_member_message_segmentation_fnc=None,
                 (i.e., between a user and his/her interlocuters)
             See segmentation callback code below for samples
             Note: we assume that member.username will be one of the segments for each member!
+        workers- number of processes to spread members over. 1 runs serially.
+            With more than one worker, get_member_message_segmentation_fnc must
+            be picklable (i.e., a module-level function like the ones below).
+            Results are identical to the serial run (except with sampling=True,
+            since each worker draws from its own random state).
+        token_cache- if True, keep tokenized message bodies in a sidecar file
+            next to each member file (see lingdistance.tokencache), so later
+            runs over the same input_dir skip tokenization.
+        stream- if True, read member files one message at a time (see
+            corpcorp.Member) and keep only term counts, for mailboxes too
+            big to load whole. Not available with sampling=True, which
+            needs every segment's messages in hand.
+            (Compiled stores are always read without loading whole.)
+        checkpoint- file to append each member's result to as soon as it is
+            done (see Checkpoint). Rerunning with the same checkpoint and
+            settings picks up where a crashed run stopped. Members whose
+            file raises are logged to checkpoint + '.errors' and skipped
+            (and retried on the next run) instead of ending the run.
 
         other kargs are for the JS distance computation. 
         see acculturation.lingdistance.jensen_shannon for documentation
@@ -99,28 +137,18 @@ def get_distances(input_dir, get_member_message_segmentation_fnc=None,
         # Default to user and interlocuters
         get_member_message_segmentation_fnc = get_userlevel_segmentation_fnc
 
-    distances = {}
-    filenames = glob.glob(os.path.join(input_dir, "*.json"))
-    for filename in filenames:
-
-        member = corpcorp.Member(filename)
-        msg_segmentation_fnc = get_member_message_segmentation_fnc(member)
+    js_kargs = dict(liwc_map=liwc_map, vocabsize=vocabsize,
+                    sampling=sampling, sampsize=sampsize,
+                    min_segment_size=min_segment_size, matrix=matrix)
+    member_kargs = dict(token_cache=token_cache, stream=stream and not sampling,
+                        compiled=compiled_store(input_dir))
 
-        # msg_segmentation_fnc will determine how msgs get put into buckets.
-        member_distances = jensen_shannon_distances(member.messages, 
-                                doc_segmentation_fnc=msg_segmentation_fnc,
-                                liwc_map=liwc_map, vocabsize=vocabsize,
-                                sampling=sampling, sampsize=sampsize,
-                                min_segment_size=min_segment_size)
-
-        # Add to distances
-        distances[member.username] = {}
-        for a,b in member_distances:
-            # Want whatever this member was getting compared to
-            # Note: member.username must have been a possible segment
-            #   returned by get_member_message_segmentation_fnc!
-            seg = a if member.username not in a else b
-            distances[member.username][seg] = member_distances[(a,b)]
+    distances = {}
+    filenames = list_members(input_dir)
+    for username, member_distances in map_members(_member_distances, filenames,
+                                get_member_message_segmentation_fnc, js_kargs, 
+                                member_kargs, workers=workers, checkpoint=checkpoint):
+        distances[username] = member_distances
 
     return distances
 
@@ -129,50 +157,694 @@ def get_distances(input_dir, get_member_message_segmentation_fnc=None,
 def get_monthly_distances(input_dir, get_member_message_segmentation_fnc=None,
                                 liwc_map=False, vocabsize=1000,
                                 sampling=False, sampsize=1000,
-                                min_segment_size=5):
+                                min_segment_size=5, matrix=False,
+                                workers=1, token_cache=False, stream=False,
+                                checkpoint=None, columnar=False, window='month'):
     """
     Behavior and args similar to get_distances, distance computation just broken up 
         to occur on a monthly basis
     Return dict same as get_distances, 
         member-level distances just broken up by month:
             {user: {(YYYY, MM): {segment: d}}}
+    or with columnar, the same as a distance_table.MonthlyDistances,
+        with the segments' message counts alongside.
+    window - 'week', 'quarter' or windows.rolling(days, stride) to break
+        distances up by other time windows instead, keyed by the
+        labels described in windows.py (not with columnar).
     """
+    if not get_member_message_segmentation_fnc:
+        # Default to user and interlocuters
+        get_member_message_segmentation_fnc = get_userlevel_segmentation_fnc
+
+    window = windows.get_window(window)
+    js_kargs = dict(liwc_map=liwc_map, vocabsize=vocabsize,
+                    sampling=sampling, sampsize=sampsize,
+                    min_segment_size=min_segment_size, matrix=matrix,
+                    window=window.spec)
+    member_kargs = dict(token_cache=token_cache, stream=stream and not sampling,
+                        compiled=compiled_store(input_dir))
+
+    filenames = list_members(input_dir)
+    if member_kargs.get('compiled') and not window.calendar_months():
+        raise ValueError("a compiled store only keeps message months, %s windows need the member files"
+                         % window.kind)
+    if columnar and window.kind != 'month':
+        raise ValueError("columnar tables only hold monthly distances")
+    if columnar:
+        return distance_table.monthly_table(map_members(_member_monthly_sized_distances, filenames,
+                                get_member_message_segmentation_fnc, js_kargs,
+                                member_kargs, workers=workers, checkpoint=checkpoint))
+
     monthly_distances = {}
+    for username, member_distances in map_members(_member_monthly_distances, filenames,
+                                get_member_message_segmentation_fnc, js_kargs, 
+                                member_kargs, workers=workers, checkpoint=checkpoint):
+        monthly_distances[username] = member_distances
+
+    return monthly_distances
+
+
+
+def get_resampled_distances(input_dir, get_member_message_segmentation_fnc=None,
+                                replicates=100, sampsize=None, bootstrap=True, seed=0,
+                                liwc_map=False, vocabsize=1000,
+                                min_segment_size=5, matrix=False,
+                                workers=1, token_cache=False, stream=False,
+                                checkpoint=None):
+    """
+    Bootstrap (or, with bootstrap=False, subsample) distributions of the
+    member-level JS distances, tokenizing each message only once; see
+    lingdistance.resampling.resampled_distances for replicates, sampsize,
+    bootstrap and seed, and get_distances for the other kargs.
+
+    Each member's samples are drawn from a RandomState seeded with seed
+    and the username, so results are reproducible whatever the workers.
+
+    return value:
+        {username: {segment: array of JS distances, one per replicate}}
+    """
+    if not get_member_message_segmentation_fnc:
+        # Default to user and interlocuters
+        get_member_message_segmentation_fnc = get_userlevel_segmentation_fnc
+
+    if not bootstrap and not sampsize:
+        raise ValueError("subsampling (bootstrap=False) needs a sampsize")
+
+    js_kargs = dict(replicates=replicates, sampsize=sampsize, bootstrap=bootstrap, seed=seed,
+                    liwc_map=liwc_map, vocabsize=vocabsize,
+                    min_segment_size=min_segment_size, matrix=matrix)
+    member_kargs = dict(token_cache=token_cache, stream=stream,
+                        compiled=compiled_store(input_dir))
+
+    distances = {}
+    filenames = list_members(input_dir)
+    for username, member_distances in map_members(_member_resampled_distances, filenames,
+                                get_member_message_segmentation_fnc, js_kargs, 
+                                member_kargs, workers=workers, checkpoint=checkpoint):
+        distances[username] = member_distances
+
+    return distances
+
+
+
+def get_segment_counts(input_dir, get_member_message_segmentation_fnc=None,
+                                workers=1, token_cache=False, stream=False,
+                                counts_file=None):
+    """
+    Tokenize every member's messages once and keep term counts per
+    (month, segment), from which distances_from_segment_counts derives
+    both the whole-period and the monthly distances without tokenizing again.
+
+    args and kargs as for get_distances, and
+        counts_file - pickle to keep the counts in across runs. If it holds
+            counts for the same member files (by name, mtime and size),
+            segmentation and tokenizer settings they are loaded instead
+            of counting again.
+
+    return value:
+        {username: (counts, sizes)}, where counts maps (month, segment) to
+        a Counter of terms and sizes maps (month, segment) to the number of
+        messages. month is (YYYY, MM), or None for messages without a date.
+    """
+    if not get_member_message_segmentation_fnc:
+        # Default to user and interlocuters
+        get_member_message_segmentation_fnc = get_userlevel_segmentation_fnc
+
+    member_kargs = dict(token_cache=token_cache, stream=stream,
+                        compiled=compiled_store(input_dir))
+
+    filenames = list_members(input_dir)
+    key = (TOKENIZER.signature(), segmentation_key(get_member_message_segmentation_fnc),
+           os.path.abspath(input_dir), _file_stamps(input_dir, filenames))
+    if counts_file:
+        segment_counts = load_segment_counts(counts_file, key)
+        if segment_counts is not None:
+            return segment_counts
+
+    segment_counts = {}
+    for username, member_counts in map_members(_member_segment_counts, filenames,
+                                get_member_message_segmentation_fnc, {}, 
+                                member_kargs, workers=workers):
+        segment_counts[username] = member_counts
+
+    if counts_file:
+        save_segment_counts(segment_counts, counts_file, key)
+    return segment_counts
+
+
+def save_segment_counts(segment_counts, filename, key=None):
+    """Pickle the output of get_segment_counts, tagged with key."""
+    _dump((key, segment_counts), filename)
+
+
+def load_segment_counts(filename, key=None):
+    """Counts saved by save_segment_counts, or None if missing or saved under another key."""
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as infile:
+        saved_key, segment_counts = cPickle.load(infile)
+    if saved_key != key:
+        return None
+    return segment_counts
+
+
+
+def distances_from_segment_counts(segment_counts, monthly=False,
+                                liwc_map=False, vocabsize=1000,
+                                min_segment_size=5, matrix=False,
+                                global_vocab=False, columnar=False):
+    """
+    Distances from the output of get_segment_counts, with the same
+    return value as get_distances, or get_monthly_distances if monthly
+    (a MonthlyDistances with columnar, too).
+    The whole-period distributions are the monthly counts summed up.
+    (No sampling here: that needs the messages themselves.)
+
+    With global_vocab, every distribution is restricted to the vocabsize
+    most frequent terms of the whole corpus rather than to its own.
+    """
+    js_kargs = dict(liwc_map=liwc_map, vocabsize=vocabsize,
+                    min_segment_size=min_segment_size, matrix=matrix)
+    if global_vocab:
+        js_kargs['vocabulary'] = global_vocabulary(
+                            (c for counts, sizes in segment_counts.itervalues() for c in counts.itervalues()),
+                            vocabsize=vocabsize, liwc_map=liwc_map)
+    if monthly and columnar:
+        return distance_table.monthly_table(
+                            (username, _monthly_distances_from_counts(username, counts, sizes, js_kargs), sizes)
+                            for username, (counts, sizes) in segment_counts.iteritems())
+    distances = {}
+    for username, (counts, sizes) in segment_counts.iteritems():
+        if monthly:
+            distances[username] = _monthly_distances_from_counts(username, counts, sizes, js_kargs)
+        else:
+            distances[username] = _distances_from_counts(username, counts, sizes, js_kargs)
+    return distances
+
+
+def sweep_distances(segment_counts, vocabsizes=(100, 500, 1000, 5000),
+                                liwc_maps=(False, True), **kargs):
+    """
+    distances_from_segment_counts for every combination of vocabsizes and
+    liwc_maps, from one set of counts. Remaining kargs are passed through.
 
+    return value:
+        {(liwc_map, vocabsize): distances}, each a separate object
+        (LIWC distances computed once are copied to the other vocabsizes)
+    """
+    sweep = {}
+    # With at least as many terms as LIWC categories, LIWC distances
+    # don't depend on vocabsize; compute them once:
+    all_categories = None
+    ncategories = len(get_liwc_index().names()) if any(liwc_maps) else None
+    for liwc_map in liwc_maps:
+        for vocabsize in vocabsizes:
+            if liwc_map and vocabsize >= ncategories and all_categories is not None:
+                sweep[(liwc_map, vocabsize)] = copy.deepcopy(all_categories)
+                continue
+            distances = distances_from_segment_counts(segment_counts, liwc_map=liwc_map,
+                                                      vocabsize=vocabsize, **kargs)
+            sweep[(liwc_map, vocabsize)] = distances
+            if liwc_map and vocabsize >= ncategories:
+                all_categories = distances
+    return sweep
+
+
+################################################
+# Incremental runs
+# Keep each member's counts and distances in a state
+# directory, and on later runs only redo the members
+# whose files changed, and of those only the months
+# whose counts changed.
+
+
+MANIFEST = 'manifest.pickle'
+
+
+def get_incremental_distances(input_dir, state_dir, get_member_message_segmentation_fnc=None,
+                                monthly=False, liwc_map=False, vocabsize=1000,
+                                min_segment_size=5, matrix=False,
+                                workers=1, stream=False):
+    """
+    Same return value as get_distances, or get_monthly_distances if
+    monthly (without sampling), but keeping state in state_dir so that
+    re-runs after new mail only recount the member files that changed.
+
+    A file counts as changed if its size or mtime differs from the last
+    run and its sha1 does too. Changed members are recounted through a
+    token cache, so only their new messages get tokenized; their
+    distances are recomputed for the months whose counts differ (all
+    of them without monthly, as whole-period counts include every month).
+
+    State from other tokenizer settings or segmentations is ignored.
+    """
     if not get_member_message_segmentation_fnc:
         # Default to user and interlocuters
         get_member_message_segmentation_fnc = get_userlevel_segmentation_fnc
 
-    filenames = glob.glob(os.path.join(input_dir, "*.json"))
+    js_kargs = dict(liwc_map=liwc_map, vocabsize=vocabsize,
+                    min_segment_size=min_segment_size, matrix=matrix)
+    member_kargs = dict(token_cache=True, stream=stream,
+                        compiled=compiled_store(input_dir))
+    filenames = list_members(input_dir)
+    if member_kargs.get('compiled'):
+        raise ValueError("incremental runs need the member json files, not a compiled store")
+
+    counts_key = (TOKENIZER.signature(), segmentation_key(get_member_message_segmentation_fnc))
+    results_key = (monthly, tuple(sorted(js_kargs.items())))
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    manifest = _load(os.path.join(state_dir, MANIFEST))
+    if not manifest or manifest['key'] != counts_key:
+        manifest = {'key': counts_key, 'files': {}}
+
+    # Which members need recounting:
+    changed = []
+    for filename in filenames:
+        entry = manifest['files'].get(filename)
+        if not (entry and os.path.isfile(_state_file(state_dir, filename))):
+            entry = None
+        stat = os.stat(filename)
+        if entry and entry[:2] == (stat.st_mtime, stat.st_size):
+            continue
+        digest = _file_sha1(filename)
+        if not (entry and entry[2] == digest):
+            changed.append(filename)
+        manifest['files'][filename] = (stat.st_mtime, stat.st_size, digest)
+
+    new_counts = dict(zip(changed, map_members(_member_segment_counts, changed,
+                                get_member_message_segmentation_fnc, {}, member_kargs, workers=workers)))
+
+    distances = {}
     for filename in filenames:
+        state = _load(_state_file(state_dir, filename))
+        if filename in new_counts:
+            username, (counts, sizes) = new_counts[filename]
+            old = state
+            state = {'username': username, 'counts': counts, 'sizes': sizes, 'results': {}}
+            if old and monthly and results_key in old['results']:
+                # Keep the months whose counts are the same as last time
+                reuse = [month for month in old['results'][results_key]
+                         if _month_counts(old, month) == _month_counts(state, month)]
+                state['results'][results_key] = {month: old['results'][results_key][month] for month in reuse}
+        if results_key not in state['results'] or (monthly and filename in new_counts):
+            state['results'][results_key] = _incremental_distances(state, monthly,
+                                state['results'].get(results_key, {}), js_kargs)
+            _dump(state, _state_file(state_dir, filename))
+        distances[state['username']] = state['results'][results_key]
+
+    # Forget files that have gone away
+    manifest['files'] = {filename: manifest['files'][filename] for filename in filenames}
+    _dump(manifest, os.path.join(state_dir, MANIFEST))
+    return distances
+
+
+def _incremental_distances(state, monthly, done, js_kargs):
+    # Distances for a member's state, reusing done months
+    username, counts, sizes = state['username'], state['counts'], state['sizes']
+    if not monthly:
+        return _distances_from_counts(username, counts, sizes, js_kargs)
+    months = set(month for month, seg in counts if month is not None) - set(done)
+    monthly_distances = _monthly_distances_from_counts(username, counts, sizes, js_kargs, months=months)
+    monthly_distances.update(done)
+    return monthly_distances
+
 
-        member = corpcorp.Member(filename)
-        msg_segmentation_fnc = get_member_message_segmentation_fnc(member)
-        monthly_distances[member.username] = {}
+def _month_counts(state, month):
+    return ({seg: c for (m, seg), c in state['counts'].iteritems() if m == month},
+            {seg: n for (m, seg), n in state['sizes'].iteritems() if m == month})
 
-        # Break up messages by month
-        months2msgs = defaultdict(list)
-        for msg in member.messages:
-            date = (msg.date.year, msg.date.month)
-            months2msgs[date].append(msg)
+
+def _state_file(state_dir, filename):
+    return os.path.join(state_dir, os.path.basename(filename) + '.state.pickle')
+
+
+def _file_stamps(input_dir, filenames):
+    """
+    (path, mtime, size) of each member file, or of each file of a
+    compiled store, to tell saved counts from stale ones.
+    """
+    if compiled.is_compiled(input_dir):
+        filenames = sorted(os.path.join(input_dir, name) for name in os.listdir(input_dir))
+    stamps = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        stamps.append((filename, stat.st_mtime, stat.st_size))
+    return tuple(stamps)
+
+
+def _file_sha1(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as infile:
+        for block in iter(lambda: infile.read(2**20), ''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _dump(obj, filename):
+    # Write via a temporary file, so an interrupted run never leaves half a pickle
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wb') as outfile:
+        cPickle.dump(obj, outfile, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmpname, filename)
+
+
+def _load(filename):
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as infile:
+        return cPickle.load(infile)
+
+
+################################################
+# Per-member work
+# These run either in-process or in a worker process,
+# so they take a single tuple argument and only
+# return plain picklable results.
+
+
+def compiled_store(input_dir):
+    """input_dir if it is a compiled store, else None (for member_kargs['compiled'])."""
+    return input_dir if compiled.is_compiled(input_dir) else None
+
+
+def list_members(input_dir):
+    """
+    Sorted member filenames of input_dir, or member indices if
+    input_dir is a compiled store.
+    """
+    if compiled.is_compiled(input_dir):
+        return range(len(compiled.open_compiled(input_dir)))
+    return sorted(glob.glob(os.path.join(input_dir, "*.json")))
+
+
+def map_members(member_fnc, filenames, get_member_message_segmentation_fnc, 
+                                js_kargs, member_kargs, workers=1, checkpoint=None):
+    """
+    Apply member_fnc to each of filenames, yielding results in filename order.
+
+    With workers > 1 the members are fanned out over a process pool;
+    imap keeps results in input order, so callers merging them into 
+    dicts get exactly what the serial loop would have produced.
+
+    With a checkpoint filename, results already in the checkpoint are
+    yielded first and not recomputed, new ones are appended to it as
+    they come in, and members that raise are quarantined (see Checkpoint).
+    """
+    if checkpoint:
+        key = (member_fnc.__name__, segmentation_key(get_member_message_segmentation_fnc),
+               sorted(js_kargs.items()), TOKENIZER.signature(), sorted(member_kargs.items()))
+        checkpoint = Checkpoint(checkpoint, key)
+        try:
+            for filename in filenames:
+                if filename in checkpoint.done:
+                    yield checkpoint.done[filename]
+            todo = [filename for filename in filenames if filename not in checkpoint.done]
+            results = map_members(Quarantined(member_fnc), todo, get_member_message_segmentation_fnc,
+                                  js_kargs, member_kargs, workers=workers)
+            for filename, (result, error) in itertools.izip(todo, results):
+                if error:
+                    checkpoint.quarantine(filename, error)
+                else:
+                    checkpoint.append(filename, result)
+                    yield result
+        finally:
+            checkpoint.close()
+        return
+    tasks = ((filename, get_member_message_segmentation_fnc, js_kargs, member_kargs) 
+                for filename in filenames)
+    if workers <= 1:
+        for result in itertools.imap(member_fnc, tasks):
+            yield result
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap(member_fnc, tasks):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+class Quarantined:
+
+    """
+    member_fnc wrapped to return (result, None), or (None, traceback)
+    if it raises, so that one bad member file doesn't end a whole run.
+    """
+
+    def __init__(self, member_fnc):
+        self.member_fnc = member_fnc
+        self.__name__ = member_fnc.__name__
+
+    def __call__(self, task):
+        try:
+            return self.member_fnc(task), None
+        except Exception:
+            return None, traceback.format_exc()
+
+
+# What unpickling the end of a checkpoint cut off mid-record raises:
+TORN_RECORD = (EOFError, cPickle.UnpicklingError)
+
+class Checkpoint:
+
+    """
+    Append-only record of finished members: a file of pickled
+    (filename, result) records after a header with the run's settings.
+    Records are flushed and synced one at a time, so a crash loses at
+    most the member in progress; a torn last record is cut off on load.
+    An unreadable header raises rather than being written over, as the
+    records after it may be intact. Members that failed go to
+    filename + '.errors' instead.
+
+    Close it (or use it in a with statement) when done.
+    """
+
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.done = {}
+        good = 0
+        if os.path.isfile(filename) and os.path.getsize(filename):
+            with open(filename, 'rb') as infile:
+                try:
+                    saved_key = cPickle.load(infile)
+                except TORN_RECORD:
+                    raise ValueError("checkpoint %s has an unreadable header; move it aside to start over"
+                                     % filename)
+                good = infile.tell()
+                if saved_key != key:
+                    raise ValueError("checkpoint %s is from a run with other settings" % filename)
+                try:
+                    while True:
+                        member_filename, result = cPickle.load(infile)
+                        self.done[member_filename] = result
+                        good = infile.tell()
+                except TORN_RECORD:
+                    pass
+        self.outfile = open(filename, 'r+b' if good else 'wb')
+        if good:
+            self.outfile.truncate(good)
+            self.outfile.seek(good)
+        else:
+            self._write(key)
+
+    def append(self, filename, result):
+        self._write((filename, result))
+        self.done[filename] = result
+
+    def quarantine(self, filename, error):
+        logging.warning("Skipping %s, it raised:\n%s", filename, error)
+        with open(self.filename + '.errors', 'ab') as errfile:
+            errfile.write("%s\n%s\n" % (filename, error))
+
+    def _write(self, record):
+        cPickle.dump(record, self.outfile, cPickle.HIGHEST_PROTOCOL)
+        self.outfile.flush()
+        os.fsync(self.outfile.fileno())
+
+    def close(self):
+        self.outfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _member_distances(task):
+    filename, get_member_message_segmentation_fnc, js_kargs, member_kargs = task
+
+    member, cache, tokenize_fnc = _load_member(filename, member_kargs)
+    msg_segmentation_fnc = get_member_message_segmentation_fnc(member)
+
+    # msg_segmentation_fnc will determine how msgs get put into buckets.
+    distances = jensen_shannon_distances(member.iter_messages(), 
+                            doc_segmentation_fnc=msg_segmentation_fnc,
+                            tokenize_fnc=tokenize_fnc,
+                            **js_kargs)
+    if cache:
+        cache.save()
+
+    return member.username, _key_by_segment(member.username, distances)
+
+
+def _member_monthly_distances(task):
+    username, monthly_distances, sizes = _monthly_distances(task)
+    return username, monthly_distances
+
+
+def _member_monthly_sized_distances(task):
+    # As _member_monthly_distances, with the messages per (month, segment)
+    return _monthly_distances(task, with_sizes=True)
+
+
+def _monthly_distances(task, with_sizes=False):
+    filename, get_member_message_segmentation_fnc, js_kargs, member_kargs = task
+
+    member, cache, tokenize_fnc = _load_member(filename, member_kargs)
+    msg_segmentation_fnc = get_member_message_segmentation_fnc(member)
+    js_kargs = dict(js_kargs)
+    window = windows.get_window(js_kargs.pop('window', 'month'))
+
+    sizes = None
+    if member_kargs.get('stream') or (member_kargs.get('compiled') and not js_kargs['sampling']):
+        # One pass over the messages, counting terms by (month, segment):
+        counts, sizes = _count_by_month(member, msg_segmentation_fnc, tokenize_fnc, window)
+        monthly_distances = _monthly_distances_from_counts(member.username, counts, sizes, js_kargs)
+        sizes = dict(sizes)
+    else:
+        monthly_distances = {}
+        if with_sizes:
+            sizes = defaultdict(int)
+        # Break up messages by month, from their dates parsed once into
+        # an array (messages whose date didn't parse are in no month, as
+        # in _count_by_month)
+        messages = list(member.iter_messages())
+        months2msgs = {}
+        for month, rows in window.group(windows.member_timestamps(member)).iteritems():
+            months2msgs[month] = [messages[i] for i in rows]
+            if with_sizes:
+                for msg in months2msgs[month]:
+                    keys = msg_segmentation_fnc(msg)
+                    for key in (keys if isinstance(keys, list) else [keys]):
+                        sizes[(month, key)] += 1
 
         # Compute JS by month
         for month, msgs in months2msgs.iteritems():
             distances = jensen_shannon_distances(msgs, 
                                 doc_segmentation_fnc=msg_segmentation_fnc,
-                                liwc_map=liwc_map, vocabsize=vocabsize,
-                                sampling=sampling, sampsize=sampsize,
-                                min_segment_size=min_segment_size)
-            
-            # Add to monthly_distances
-            monthly_distances[member.username][month] = {}
-            for a,b in distances:
-                seg = a if member.username not in a else b
-                monthly_distances[member.username][month][seg] = distances[(a,b)]       
+                                tokenize_fnc=tokenize_fnc,
+                                **js_kargs)
+            monthly_distances[month] = _key_by_segment(member.username, distances)
+    if cache:
+        cache.save()
+
+    return member.username, monthly_distances, sizes and dict(sizes)
+
+
+def _member_resampled_distances(task):
+    filename, get_member_message_segmentation_fnc, js_kargs, member_kargs = task
 
+    member, cache, tokenize_fnc = _load_member(filename, member_kargs)
+    msg_segmentation_fnc = get_member_message_segmentation_fnc(member)
+    message_counts = MessageCounts(member.iter_messages(), msg_segmentation_fnc,
+                                   tokenize_fnc=tokenize_fnc)
+    if cache:
+        cache.save()
+
+    js_kargs = dict(js_kargs)
+    # A seed per member, independent of the order members are processed in
+    js_kargs['seed'] = zlib.crc32(repr((js_kargs['seed'], member.username))) & 0xffffffff
+    distances = resampled_distances(message_counts, **js_kargs)
+    return member.username, _key_by_segment(member.username, distances)
+
+
+def _member_segment_counts(task):
+    filename, get_member_message_segmentation_fnc, js_kargs, member_kargs = task
+
+    member, cache, tokenize_fnc = _load_member(filename, member_kargs)
+    msg_segmentation_fnc = get_member_message_segmentation_fnc(member)
+    counts, sizes = _count_by_month(member, msg_segmentation_fnc, tokenize_fnc)
+    if cache:
+        cache.save()
+
+    return member.username, (dict(counts), dict(sizes))
+
+
+def _count_by_month(member, msg_segmentation_fnc, tokenize_fnc, window=windows.WINDOWS['month']):
+    # Counts keyed (month, segment), month None for undated messages;
+    # with another window, by each of the message's windows instead
+    def monthly_segmentation_fnc(msg):
+        keys = msg_segmentation_fnc(msg)
+        if not isinstance(keys, list):
+            keys = [keys]
+        timestamp = msg.timestamp()
+        months = [None] if timestamp is None else window.labels_of(timestamp)
+        return [(month, k) for month in months for k in keys]
+    return segment_term_counts(member.iter_messages(), monthly_segmentation_fnc,
+                               tokenize_fnc=tokenize_fnc)
+
+
+def _monthly_distances_from_counts(username, counts, sizes, js_kargs, months=None):
+    monthly_distances = {}
+    if months is None:
+        months = set(month for month, seg in counts if month is not None)
+    for month in months:
+        distances = distances_from_counts(
+                            {seg: c for (m, seg), c in counts.iteritems() if m == month},
+                            {seg: n for (m, seg), n in sizes.iteritems() if m == month},
+                            liwc_map=js_kargs['liwc_map'], vocabsize=js_kargs['vocabsize'],
+                            min_segment_size=js_kargs['min_segment_size'],
+                            matrix=js_kargs['matrix'], vocabulary=js_kargs.get('vocabulary'))
+        monthly_distances[month] = _key_by_segment(username, distances)
     return monthly_distances
 
 
+def _distances_from_counts(username, counts, sizes, js_kargs):
+    # Sum the months back up into whole-period segments
+    seg_counts = defaultdict(Counter)
+    seg_sizes = defaultdict(int)
+    for (month, seg), c in counts.iteritems():
+        seg_counts[seg].update(c)
+        seg_sizes[seg] += sizes[(month, seg)]
+    distances = distances_from_counts(seg_counts, seg_sizes,
+                            liwc_map=js_kargs['liwc_map'], vocabsize=js_kargs['vocabsize'],
+                            min_segment_size=js_kargs['min_segment_size'],
+                            matrix=js_kargs['matrix'], vocabulary=js_kargs.get('vocabulary'))
+    return _key_by_segment(username, distances)
+
+
+def _load_member(filename, member_kargs):
+    """
+    The member to work on, its token cache (or None) and the 
+    tokenize_fnc to hand to jensen_shannon_distances.
+    """
+    if member_kargs.get('compiled'):
+        member = compiled.open_compiled(member_kargs['compiled']).member(filename)
+        return member, None, member.tokenize
+    member = corpcorp.Member(filename, stream=member_kargs.get('stream'))
+    if member_kargs.get('token_cache'):
+        cache = TokenCache(filename, TOKENIZER)
+        return member, cache, cache.tokenize
+    return member, None, None
+
+
+def _key_by_segment(username, distances):
+    # Want whatever this member was getting compared to
+    # Note: member.username must have been a possible segment
+    #   returned by get_member_message_segmentation_fnc!
+    segment_distances = {}
+    for a,b in distances:
+        seg = a if username not in a else b
+        segment_distances[seg] = distances[(a,b)]
+    return segment_distances
+
+
 ################################################
 # Segmentation callbacks
 # These fncs generate the callbacks
@@ -183,28 +855,42 @@ def get_monthly_distances(input_dir, get_member_message_segmentation_fnc=None,
 
 def get_dyadic_segmentation_fnc(member):
     """ compare each user to each other user """
+    username = member.username
     def dyadic_segmentation_fnc(msg):
         # Just care who this message was from
-        # (but msg.frm might be messy, from email header)
-        if member.username in msg.frm:
+        if username in msg.frm:
             # Msg from our src_user
-            return [member.username]
+            return [username]
         else:
             # An interlocuter
-            return [msg.frm]
+            # (msg.frm is messy, from email header, so go by its address)
+            return [SENDERS.email(SENDERS.sender_id(msg.frm))]
     return dyadic_segmentation_fnc
+get_dyadic_segmentation_fnc.version = 3
 
 
 def get_userlevel_segmentation_fnc(member):
     """ compare each user to set of all of user's interlocuters """
+    username = member.username
     def user_level_segmentation_fnc(msg):
-        if member.username in msg.frm:
+        if username in msg.frm:
             # Msg from our src_user
-            return [member.username]
+            return [username]
         else:
             # An interlocuter
             return ["other"]
     return user_level_segmentation_fnc
+get_userlevel_segmentation_fnc.version = 3
+
+
+def segmentation_key(get_member_message_segmentation_fnc):
+    """
+    What identifies a segmentation in saved counts and checkpoints: the
+    callback's name, and its version attribute if it has one (bumped
+    when the segments it returns change).
+    """
+    return (get_member_message_segmentation_fnc.__name__,
+            getattr(get_member_message_segmentation_fnc, 'version', 1))
 
 
 
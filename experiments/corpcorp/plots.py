@@ -7,9 +7,9 @@ from operator import itemgetter
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
-import scipy.stats
 import sys
-import random
+
+import groupstats
 
 # The first set of colors is good for colorbind people:
 colors = ['#1B9E77', '#D95F02', '#7570B3', '#E7298A', '#66A61E', '#E6AB02', '#A6761D', '#666666'] + matplotlib.colors.cnames.values()
@@ -23,40 +23,62 @@ def plot_js_distances(
         logscale=True, 
         sampsize=None, 
         title="Linguistic distance from one's email interlocutors",
-        ylabel="Jensen-Shannon distance"): 
+        ylabel="Jensen-Shannon distance",
+        mode='auto',
+        seed=0): 
     """data should be a dict mapping the keys group1 and group2 to dicts mapping usernames to JS values.
-    if sampsize is an int, then sampsize values are chosen from each class. logscale=True can help with 
-    plotting and does not affect the Mann-Whitney U test done by boxplot_with_datapoints."""
-    living = data[group1].values()
-    departed = data[group2].values()
+    if sampsize is an int, then sampsize values are chosen from each class, for the plot and for each
+    of the resamples the Mann-Whitney U test is run on. logscale=True can help with plotting and does
+    not affect the test. mode is as for boxplot_with_datapoints.
+    The reported U and p-value are two-sided, as scipy.stats.mannwhitneyu(alternative='two-sided'):
+    U counts the (group1, group2) pairs with the group1 value larger. Earlier versions reported
+    scipy's default, the smaller U and a one-sided p-value, half of the two-sided one."""
+    grp1 = np.fromiter(data[group1].itervalues(), dtype=np.float64)
+    grp2 = np.fromiter(data[group2].itervalues(), dtype=np.float64)
+    stats = groupstats.compare_groups(grp1, grp2, sampsize=sampsize, seed=seed)
     if sampsize:
         # Warning about sizes:
         for vals, label in ((grp1, group1), (grp2, group2)):
             if sampsize > len(vals):
                 print "Warning: sampsize %s is larger than len(%s) = %s" % (sampsize, label, len(vals))            
         # Get the sample:
-        random.shuffle(grp1)
-        grp1 = grp1[ : sampsize]
-        random.shuffle(grp2)
-        grp2 = grp2[ :sampsize]            
+        rng = np.random.RandomState(seed)
+        grp1 = groupstats.resample(grp1, min(sampsize, len(grp1)), 1, rng, replace=False)[0]
+        grp2 = groupstats.resample(grp2, min(sampsize, len(grp2)), 1, rng, replace=False)[0]
     boxplot_with_datapoints([grp1, grp2], 
                             title=title, 
                             ylabel=ylabel, 
-                            xlabels=('%s (n=%s)' % (group1, len(living)), 'Departed (n=%s)' % (group2, len(departed))),
-                            logscale=logscale)
+                            xlabels=('%s (n=%s)' % (group1, len(grp1)), '%s (n=%s)' % (group2, len(grp2))),
+                            logscale=logscale,
+                            mode=mode,
+                            stats=stats)
 
 ######################################################################
 
-def boxplot_with_datapoints(vals, title="", ylabel="", xlabels=[], logscale=True):
-    """Generic boxplot function used throughout."""    
+# Beyond this many values in a group, mode='auto' draws densities
+# rather than one point per value:
+MAX_POINTS = 2000
+
+def boxplot_with_datapoints(vals, title="", ylabel="", xlabels=[], logscale=True, mode='auto', stats=None):
+    """Generic boxplot function used throughout.
+    mode is how the values are drawn over the boxes: 'points' (jittered), 'binned' (a histogram
+    per group), 'hexbin' (counts of the jittered points) or 'violin'; 'auto' picks 'points', or
+    'violin' for groups of more than MAX_POINTS. stats is a groupstats.compare_groups result for
+    vals[0] and vals[1], computed here if not given."""
+    vals = [np.asarray(v, dtype=np.float64) for v in vals]
     # Dummy labels if none were provided:
     if not xlabels:
         xlabels = ["X%s" % (i+1) for i in range(len(vals))]
+    # Test stats, on the untransformed values:
+    if stats is None:
+        stats = groupstats.compare_groups(vals[0], vals[1])
     # Optional log-scale transformation:
     if logscale:
         vals = [np.log(v) for v in vals]    
         if ylabel:
             ylabel = "log(%s)" % ylabel
+    if mode == 'auto':
+        mode = 'violin' if max(len(v) for v in vals) > MAX_POINTS else 'points'
     # The main boxplot:
     fig = plt.figure(figsize=(6, 6)) 
     xlocs = np.arange(1.0, len(vals)+1, 1.0)
@@ -68,21 +90,32 @@ def boxplot_with_datapoints(vals, title="", ylabel="", xlabels=[], logscale=True
     plt.setp(bp['boxes'], color='black')
     plt.setp(bp['whiskers'], color='black')
     plt.setp(bp['medians'], color='black')
-    # Add data points with horizontal jitter for visibility:
-    for i, cat_vals in enumerate(vals):
-        plt.plot(jitter(np.repeat(xlocs[i], len(cat_vals))), cat_vals, marker='.', markersize=8, linestyle="", color=colors[i])    
+    if mode == 'points':
+        # Add data points with horizontal jitter for visibility:
+        for i, cat_vals in enumerate(vals):
+            plt.plot(jitter(np.repeat(xlocs[i], len(cat_vals))), cat_vals, marker='.', markersize=8, linestyle="", color=colors[i])    
+    elif mode == 'binned':
+        # Each group's histogram, drawn sideways and centered on the box:
+        edges, shares = groupstats.density_bins(vals)
+        scale = 0.4 / max(s.max() for s in shares)
+        for i, share in enumerate(shares):
+            halfwidth = np.repeat(share * scale, 2)
+            ys = np.repeat(edges, 2)[1:-1]
+            plt.fill_betweenx(ys, xlocs[i] - halfwidth, xlocs[i] + halfwidth, color=colors[i], alpha=0.5, linewidth=0)
+    elif mode == 'hexbin':
+        xs = np.concatenate([jitter(np.repeat(xlocs[i], len(cat_vals))) for i, cat_vals in enumerate(vals)])
+        plt.hexbin(xs, np.concatenate(vals), gridsize=(4 * len(vals), 40), bins='log', mincnt=1, cmap='Greys')
+    elif mode == 'violin':
+        parts = plt.violinplot(vals, positions=xlocs, widths=0.75, showextrema=False)
+        for i, body in enumerate(parts['bodies']):
+            body.set_facecolor(colors[i])
+    else:
+        raise ValueError("Unknown mode %r" % mode)
     plt.title(title)
     plt.ylabel(ylabel)
     plt.xlabel("")
     _ = plt.xticks(xlocs, xlabels)
-    # Test stats:
-    ustat, pval = scipy.stats.mannwhitneyu(vals[0], vals[1])
-    pval = np.round(pval, 4)
-    # Avoid printing spurious and impossible 0.0 p values:
-    pval_report = "p = %s" % pval
-    if pval == 0.0:
-        pval_report = "p < 0.001"    
-    test_report = "Mann-Whitney U = %s; %s" % (ustat, pval_report)
+    test_report = groupstats.test_report(stats)
     x1, x2, y1, y2 = plt.axis()
     plt.text(x1, y1, test_report, verticalalignment='bottom', horizontalalignment='left')
     
@@ -94,28 +127,32 @@ def jitter(x, sd=0.1):
 ###############################################################################
 
 def plot_trajectories(data, min_months=4, max_months=12, zscore=False, logscale=False):
-    """JS distances over time."""
+    """JS distances over time. data is a distance_table.MonthlyDistances (plotting each user's
+    monthly means) or a dict mapping users to {(YYYY, MM): distance} dicts."""
+    if hasattr(data, 'trajectories'):
+        trajectories = data.trajectories(min_months=min_months, max_months=max_months)
+    else:
+        trajectories = {}
+        for user, date_dict in data.items():
+            if len(date_dict) >= min_months and len(date_dict) <= max_months:
+                dates, vals = zip(*sorted(date_dict.items()))
+                trajectories[user] = (np.array([y * 12 + m - 1 for y, m in dates]), np.array(vals))
     fig = plt.figure(figsize=(24, 10)) 
-    all_dates = sorted(set(date for u, date_dict in data.items() for date in date_dict.keys()))
+    all_months = np.unique(np.concatenate([months for months, vals in trajectories.values()] or [[]])).astype(int)
     color_index = 0
-    for user, date_dict in data.items():
-        if len(date_dict) >= min_months and len(date_dict) <= max_months:
-            date_pairs = sorted(date_dict.items())
-            # Remove the final month, which might be short and so misleading:
-            date_pairs = date_pairs[ :-1]                                
-            dates, vals = zip(*date_pairs)
-            # Logscale (done first for compatibility with zscore):
-            if logscale:
-                vals = np.log(vals)
-            # Standarize scores to have mean 0.0:
-            if zscore:
-                zscore = (lambda x : (x-np.mean(vals)) / np.std(vals))
-                vals = [zscore(x) for x in vals]                 
-            locs = [i for i, d in enumerate(all_dates) if d in dates]
-            plt.plot(locs, vals, linestyle='-', marker='', linewidth=4, color=colors[color_index])
-            color_index += 1
-    xlocs, xstrs = plt.xticks()
-    plt.xticks(xlocs, ["%s-%s" % d for d in all_dates], rotation='vertical')
+    for user, (months, vals) in sorted(trajectories.items()):
+        # Remove the final month, which might be short and so misleading:
+        months, vals = months[ :-1], vals[ :-1]
+        # Logscale (done first for compatibility with zscore):
+        if logscale:
+            vals = np.log(vals)
+        # Standarize scores to have mean 0.0:
+        if zscore:
+            vals = (vals - np.mean(vals)) / np.std(vals)
+        locs = np.searchsorted(all_months, months)
+        plt.plot(locs, vals, linestyle='-', marker='', linewidth=4, color=colors[color_index])
+        color_index += 1
+    plt.xticks(np.arange(len(all_months)), ["%s-%s" % (m // 12, m % 12 + 1) for m in all_months], rotation='vertical')
     ylabel = "Jensen-Shannon distance"
     if logscale:
         ylabel = "log(%s)" % ylabel
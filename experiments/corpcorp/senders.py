@@ -0,0 +1,59 @@
+from email.utils import parseaddr
+
+"""
+Normalization of From: headers for the segmentation callbacks.
+
+The same person turns up under many headers ("Zed <zed@x.com>",
+"\"Zed X\" <zed@x.com>", "zed@x.com"). SenderIndex parses each distinct
+header once, maps it to the canonical (lower-cased) address, and gives
+every address an integer sender id; the dyadic callback then keys
+interlocutors' segments on the address rather than the raw header.
+(Whether a message is the member's own is still decided by the callbacks
+themselves, by username occurring in the raw header.)
+
+The module-level SENDERS is shared by all the members a process works
+on, so the headers of common interlocutors are only parsed once.
+"""
+
+
+def canonical_email(header):
+    """
+    The lower-cased address in a From: header, or the whitespace-
+    normalized, lower-cased header itself if it holds no address.
+    """
+    name, address = parseaddr(header)
+    address = address.strip().lower()
+    if '@' not in address:
+        return u" ".join(header.lower().split())
+    return address
+
+
+class SenderIndex:
+
+    def __init__(self):
+        self.ids = {}
+        self.emails = []
+        self.headers = {}
+
+    def sender_id(self, header):
+        """Integer id of the address in header."""
+        try:
+            return self.headers[header]
+        except KeyError:
+            pass
+        email = canonical_email(header)
+        if email not in self.ids:
+            self.ids[email] = len(self.emails)
+            self.emails.append(email)
+        sender = self.headers[header] = self.ids[email]
+        return sender
+
+    def email(self, sender):
+        """Canonical address of sender id."""
+        return self.emails[sender]
+
+    def __len__(self):
+        return len(self.emails)
+
+
+SENDERS = SenderIndex()
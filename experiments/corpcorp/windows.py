@@ -0,0 +1,133 @@
+import numpy as np
+
+from corpcorp import days_from_civil, civil_from_days
+import compiled
+
+"""
+Time windows for the temporal experiments.
+
+A member's message dates are parsed once into an int64 array of
+timestamps (member_timestamps, seconds since 1970-01-01 in each
+message's own local time, see corpcorp.parse_timestamp), and messages
+are bucketed by integer arithmetic on it. A Window numbers its windows
+with integers and labels them with the keys results are stored under:
+
+    'month'       (YYYY, MM)
+    'quarter'     (YYYY, Q), Q in 1-4
+    'week'        (YYYY, MM, DD) of the Monday the week starts on
+    rolling(d, s) (YYYY, MM, DD) of the first day, for windows of d days
+                  starting every s days (counted from 1970-01-01), so
+                  that with s < d a message falls in several windows
+
+    window = get_window('week')
+    for label, rows in window.group(member_timestamps(member)).iteritems():
+        ...  # rows: positions of the week's messages in member.iter_messages()
+"""
+
+# Timestamp of messages without a (parseable) date:
+MISSING = np.iinfo(np.int64).min
+
+DAY = 86400
+
+
+def member_timestamps(member):
+    """int64 array of the timestamps of member's messages, in order."""
+    if isinstance(member, compiled.CompiledMember):
+        # The store only keeps months (see compiled.py)
+        month = np.asarray(member.corpus.month[member.start:member.stop], dtype=np.int64)
+        return np.where(month >= 0, days_from_civil(month // 12, month % 12 + 1, 1) * DAY, MISSING)
+    timestamps = (msg.timestamp() for msg in member.iter_messages())
+    return np.fromiter((MISSING if ts is None else ts for ts in timestamps), dtype=np.int64)
+
+
+def month_index(timestamps):
+    """year*12 + month-1 of each timestamp (-1 where MISSING), as in compiled.py."""
+    year, month, day = civil_from_days(timestamps // DAY)
+    return np.where(timestamps != MISSING, year * 12 + month - 1, -1)
+
+
+class Window:
+
+    KINDS = ('month', 'quarter', 'week', 'rolling')
+
+    def __init__(self, kind, days=None, stride=None):
+        if kind not in self.KINDS:
+            raise ValueError("Unknown window %r" % kind)
+        if kind == 'rolling' and not (days > 0 and (stride or days) > 0):
+            raise ValueError("Rolling windows need positive days and stride")
+        self.kind = kind
+        self.days = days
+        self.stride = (stride or days) if kind == 'rolling' else None
+        # A picklable, comparable stand-in, for checkpoint keys:
+        self.spec = (kind, self.days, self.stride)
+
+    def calendar_months(self):
+        """Whether windows are made of whole months (all a compiled store can do)."""
+        return self.kind in ('month', 'quarter')
+
+    def span(self, days):
+        """Ids of the first and last windows covering day numbers days."""
+        if self.kind == 'rolling':
+            return (days - self.days) // self.stride + 1, days // self.stride
+        if self.kind == 'week':
+            # Day 0 was a Thursday
+            wid = (days + 3) // 7
+        else:
+            year, month, day = civil_from_days(days)
+            wid = year * 12 + month - 1
+            if self.kind == 'quarter':
+                wid = wid // 3
+        return wid, wid
+
+    def label(self, wid):
+        """The key of window wid."""
+        wid = int(wid)
+        if self.kind == 'month':
+            return (wid // 12, wid % 12 + 1)
+        if self.kind == 'quarter':
+            return (wid // 4, wid % 4 + 1)
+        first = wid * 7 - 3 if self.kind == 'week' else wid * self.stride
+        return tuple(int(x) for x in civil_from_days(first))
+
+    def labels_of(self, timestamp):
+        """Labels of the windows one timestamp (or None) falls in."""
+        if timestamp is None or timestamp == MISSING:
+            return []
+        first, last = self.span(timestamp // DAY)
+        return [self.label(wid) for wid in range(first, last + 1)]
+
+    def assign(self, timestamps):
+        """
+        (rows, ids) arrays with an entry for each window a timestamp
+        falls in: its position in timestamps, and the window's id.
+        """
+        rows = np.flatnonzero(timestamps != MISSING)
+        first, last = self.span(timestamps[rows] // DAY)
+        counts = last - first + 1
+        # Each row's run of ids first, first+1, ..., last:
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(rows, counts), np.repeat(first, counts) + offsets
+
+    def group(self, timestamps):
+        """{label: positions in timestamps of the window's messages, in order}"""
+        rows, ids = self.assign(timestamps)
+        order = np.lexsort((rows, ids))
+        rows, ids = rows[order], ids[order]
+        starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]])) if len(ids) else ids
+        stops = np.append(starts[1:], len(ids))
+        return {self.label(ids[start]): rows[start:stop] for start, stop in zip(starts, stops)}
+
+
+WINDOWS = {kind: Window(kind) for kind in ('month', 'quarter', 'week')}
+
+def rolling(days, stride=None):
+    """Window of days days, starting every stride days (default: days)."""
+    return Window('rolling', days, stride)
+
+def get_window(window):
+    """Window for 'month', 'quarter', 'week', a Window or a Window's spec."""
+    if isinstance(window, basestring):
+        return WINDOWS[window]
+    if isinstance(window, tuple):
+        return Window(*window)
+    return window
@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import random
+import subprocess
+import multiprocessing
+from collections import Counter
+import numpy as np
+
+import jensen_shannon
+import tokenizers
+
+"""
+Micro-benchmarks for the hot paths in lingdistance.
+
+Run e.g.
+
+    python -m acculturation.lingdistance.benchmarks liwc [member.json ...]
+
+With corpcorp member files as arguments the benchmarks use their
+message bodies, otherwise a synthetic email-like corpus.
+
+These only time the fast paths against their references; that they
+agree is checked by the tests (tests/test_*.py, run with pytest).
+"""
+
+SAMPLE_WORDS = (u"i me you we they the a an to of and in that have it for not on with he as "
+                u"do at this but his by from meeting tomorrow project thanks please call "
+                u"work happy sad angry money family friend think know feel said want "
+                u"never nothing really very great terrible deal bank report review").split()
+
+
+def load_texts(filenames=None, n=300, seed=0):
+    """Message bodies from corpcorp json files, or n synthetic ones."""
+    if filenames:
+        texts = []
+        for filename in filenames:
+            with open(filename, 'rb') as infile:
+                texts += [m.get('body') or u"" for m in json.load(infile)]
+        return texts
+    rng = random.Random(seed)
+    return [u" ".join(rng.choice(SAMPLE_WORDS) for _ in range(rng.randint(20, 200)))
+            for _ in range(n)]
+
+
+def timeit(fnc, *args, **kargs):
+    """Best-of-3 wall time of fnc(*args, **kargs), and its last result."""
+    best = None
+    for _ in range(kargs.pop('repeat', 3)):
+        start = time.time()
+        result = fnc(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_memory(fnc, *args):
+    """
+    MB by which peak resident memory grows while fnc(*args) runs, measured
+    in a forked child so that each measurement starts from the same state.
+    Linux only (reads /proc/self/status).
+    """
+    def status(field):
+        with open('/proc/self/status') as infile:
+            for line in infile:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024.
+    def child(queue):
+        start = status('VmRSS')
+        fnc(*args)
+        queue.put(status('VmHWM') - start)
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=child, args=(queue,))
+    proc.start()
+    growth = queue.get()
+    proc.join()
+    return growth
+
+def report(label, secs, baseline=None):
+    line = "%-30s %9.4fs" % (label, secs)
+    if baseline:
+        line += "   x%.1f" % (baseline / secs)
+    print line
+
+######################################################################
+
+def bench_liwc(texts):
+    words = [w for text in texts for w in jensen_shannon.tokenize(text)]
+    print "LIWC collapse over %s tokens (%s distinct)" % (len(words), len(set(words)))
+    regex_secs, regex_cats = timeit(jensen_shannon.collapse_by_liwc_regex, words, repeat=1)
+    report("regex per category", regex_secs)
+    # Cold: fresh memo, every distinct word resolved once
+    jensen_shannon.get_liwc_index().memo.clear()
+    cold_secs, index_cats = timeit(jensen_shannon.collapse_by_liwc, words, repeat=1)
+    report("index (cold memo)", cold_secs, regex_secs)
+    warm_secs, index_cats = timeit(jensen_shannon.collapse_by_liwc, words)
+    report("index (warm memo)", warm_secs, regex_secs)
+
+def bench_js(texts, nsegments=20):
+    # Split the texts into segments, as jensen_shannon_distances would
+    docs = [{'text': text} for text in texts]
+    segments = [docs[i::nsegments] for i in range(nsegments)]
+    dists = [jensen_shannon.get_term_count_distribution(seg) for seg in segments]
+    pairs = [(i, j) for i in range(nsegments) for j in range(i+1, nsegments)]
+    print "JS over %s segment pairs" % len(pairs)
+    dict_secs, dict_ds = timeit(lambda: [jensen_shannon.jensen_shannon(dists[i], dists[j]) for i, j in pairs])
+    report("dict jensen_shannon", dict_secs)
+    vocab = jensen_shannon.Vocabulary()
+    sparse = [vocab.distribution(d) for d in dists]
+    sparse_secs, sparse_ds = timeit(lambda: [jensen_shannon.sparse_jensen_shannon(sparse[i], sparse[j]) for i, j in pairs])
+    report("sparse_jensen_shannon", sparse_secs, dict_secs)
+
+def bench_matrix(texts, nsegments=200):
+    # Many small segments, like a dyadic segmentation of a busy mailbox
+    docs = [{'text': text} for text in texts]
+    segments = [docs[i::nsegments] for i in range(nsegments)]
+    vocab = jensen_shannon.Vocabulary()
+    sparse = [vocab.distribution(jensen_shannon.get_term_count_distribution(seg)) for seg in segments]
+    print "All-pairs JS over %s segments, vocabulary of %s" % (nsegments, len(vocab))
+    def pairwise():
+        return [jensen_shannon.sparse_jensen_shannon(sparse[i], sparse[j])
+                for i in range(nsegments) for j in range(i+1, nsegments)]
+    pair_secs, pair_ds = timeit(pairwise)
+    report("sparse_jensen_shannon loop", pair_secs)
+    matrix_secs, dmatrix = timeit(jensen_shannon.jensen_shannon_matrix, sparse, len(vocab))
+    report("jensen_shannon_matrix", matrix_secs, pair_secs)
+
+def flat_term_count_distribution(messages, vocabsize=1000, liwc_map=False):
+    # get_term_count_distribution as it was: every token of the segment
+    # in one list, and with LIWC every category occurrence in another.
+    words = [w for msg in messages for w in jensen_shannon.tokenize(msg['text'])]
+    if liwc_map:
+        words = jensen_shannon.collapse_by_liwc(words)
+    return jensen_shannon.counts_to_distribution(Counter(words), vocabsize=vocabsize)
+
+def bench_memory(texts, copies=30):
+    # One big segment, e.g. a prolific member's whole mailbox
+    docs = [{'text': text} for text in texts] * copies
+    print "Term counting over one segment of %s messages" % len(docs)
+    for liwc_map in (False, True):
+        flat_mb = peak_memory(flat_term_count_distribution, docs, 1000, liwc_map)
+        stream_mb = peak_memory(jensen_shannon.get_term_count_distribution, docs, 1000, liwc_map)
+        print "%-30s %7.1f MB" % ("flattened lists" + (" (LIWC)" if liwc_map else ""), flat_mb)
+        print "%-30s %7.1f MB" % ("per-message counts" + (" (LIWC)" if liwc_map else ""), stream_mb)
+
+def bench_tokenize(texts):
+    print "Tokenizing %s texts" % len(texts)
+    tok = jensen_shannon.TOKENIZER
+    ref_secs, ref_words = timeit(lambda: [tok.tokenize_reference(t) for t in texts])
+    report("per-option passes", ref_secs)
+    fused_secs, fused_words = timeit(lambda: [tok.tokenize(t) for t in texts])
+    report("single pass", fused_secs, ref_secs)
+
+ENTITIES = [u"&amp;", u"&lt;", u"&gt;", u"&quot;", u"&nbsp;", u"&eacute;", u"&#39;", u"&#8217;",
+            u"&#38;", u"&#38;amp;", u"&#0059;", u"&#99999999;", u"&bogus;", u"&", u"#", u";", u"amp"]
+
+def entity_texts(texts, share=0.2, seed=0):
+    """texts with entities (and entity fragments) sprinkled into a share of them."""
+    rng = random.Random(seed)
+    result = []
+    for text in texts:
+        if rng.random() < share:
+            words = text.split(u" ")
+            for _ in range(rng.randint(1, 10)):
+                words.insert(rng.randint(0, len(words)), rng.choice(ENTITIES))
+            text = rng.choice([u" ", u""]).join(words)
+        result.append(text)
+    return result
+
+def bench_html(texts):
+    texts = entity_texts(texts)
+    print "html2unicode over %s texts, %s with an '&'" % (len(texts), sum(u"&" in t for t in texts))
+    ref_secs, ref_out = timeit(lambda: map(tokenizers.html2unicode_reference, texts))
+    report("replace per entity", ref_secs)
+    fast_secs, fast_out = timeit(lambda: map(tokenizers.html2unicode, texts))
+    report("single substitution", fast_secs, ref_secs)
+
+def cold_start(code, repeat=3):
+    """Best-of wall time of a fresh interpreter (as a spawned worker would be) running code."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_import(texts):
+    module = jensen_shannon.__name__
+    print "Cold start of a fresh interpreter importing %s" % module
+    bare_secs = cold_start("pass")
+    report("interpreter alone", bare_secs)
+    import_secs = cold_start("import %s" % module)
+    report("import", import_secs)
+    table_secs = cold_start("import %s as js; js.get_liwc_index()" % module)
+    report("import + LIWC table", table_secs)
+    pickle_secs = cold_start("import %s as js, cPickle; js.LiwcIndex(cPickle.load(open(js.LIWC_PICKLE, 'rb')))"
+                             % module)
+    report("import + LIWC regex pickle", pickle_secs)
+
+######################################################################
+
+BENCHMARKS = {
+    'liwc': bench_liwc,
+    'js': bench_js,
+    'matrix': bench_matrix,
+    'html': bench_html,
+    'import': bench_import,
+    'memory': bench_memory,
+    'tokenize': bench_tokenize,
+    }
+
+if __name__ == '__main__':
+    names = sys.argv[1:2] or sorted(BENCHMARKS)
+    texts = load_texts(sys.argv[2:])
+    for name in names:
+        BENCHMARKS[name](texts)
+        print
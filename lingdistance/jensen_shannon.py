@@ -4,18 +4,39 @@ import re
 import glob
 import sys
 import random
+import heapq
 import logging
 import cPickle as pickle
-from operator import itemgetter
 from collections import defaultdict, Counter
 import numpy as np
 
+import tokenizers
 from tokenizers import TwitterTokenizer as Tokenizer
+from liwc import LiwcIndex, load_table
 
 ############
 
 DIR = os.path.split(__file__)[0]
-LIWC = pickle.load(file(os.path.join(DIR, 'LIWC2007dictionary_regex.pickle')))
+LIWC_PICKLE = os.path.join(DIR, 'LIWC2007dictionary_regex.pickle')
+# The same dictionary as a liwc.save_table table, much quicker to load:
+LIWC_TABLE = os.path.join(DIR, 'LIWC2007dictionary_index.json')
+
+# Loaded on first use, since runs without liwc_map never need it:
+_liwc_index = None
+
+def get_liwc_index():
+    """The LiwcIndex of the LIWC dictionary."""
+    global _liwc_index
+    if _liwc_index is None:
+        if os.path.isfile(LIWC_TABLE):
+            _liwc_index = load_table(LIWC_TABLE)
+        else:
+            _liwc_index = LiwcIndex(pickle.load(file(LIWC_PICKLE)))
+    return _liwc_index
+
+def get_liwc():
+    """The LIWC dictionary, {category: compiled regex}."""
+    return get_liwc_index().full_regexes()
 
 TOKENIZER = Tokenizer(preserve_case=False,
                       preserve_all_caps=False,
@@ -27,12 +48,16 @@ TOKENIZER = Tokenizer(preserve_case=False,
                       normalize_dates=True,
                       mark_negation_scope=False)
 
+# Memory budget (bytes) for each temporary array in jensen_shannon_matrix:
+BLOCK_BYTES = 64 * 2**20
+
 ############
 
 def jensen_shannon_distances(documents, doc_segmentation_fnc=lambda x: [x['frm']], 
                                 liwc_map=False, vocabsize=1000,
                                 sampling=False, sampsize=1000,
-                                min_segment_size=100):
+                                min_segment_size=100, tokenize_fnc=None,
+                                matrix=False, condensed=False, vocabulary=None):
     """
     Workhorse function for measuring JS distance between two sets of documents.
     
@@ -43,28 +68,39 @@ def jensen_shannon_distances(documents, doc_segmentation_fnc=lambda x: [x['frm']
             each string a representation of a segment the document belongs to
 
     kargs:
-
+        tokenize_fnc - callable mapping a document's text to a list of words.
+            Defaults to tokenize (the module TOKENIZER); pass e.g. the
+            tokenize method of a tokencache.TokenCache to reuse earlier runs.
+        matrix - compute all pairs at once with jensen_shannon_matrix rather
+            than pair by pair. Much faster with many segments (e.g. dyadic
+            segmentation); same distances to floating-point tolerance.
+        condensed - implies matrix; return (segments, condensed distances)
+            instead of the dict, see below.
+        vocabulary - set of terms (e.g. from global_vocabulary) to restrict
+            every segment to, instead of each segment's own top vocabsize.
 
     return value:
         for each pair of segments of documents (as defined by what 
         doc_segmentation_fnc returns), we compute the JS-distance. 
         Return format is a dict--
             {('segment1', 'segment2'): JS distance (float)}
+        With condensed=True, a tuple (segments, distances) where segments
+        is the sorted list of segments and distances the condensed
+        distance vector in scipy.spatial.distance.pdist order.
     """
 
-    # Put documents into buckets that we want to compare:
-    segments2docs = defaultdict(list)
-    for i, msg in enumerate(documents):
-        sys.stderr.write('\r') ; sys.stderr.write('msg %s' % i) ; sys.stderr.flush()
-        keys = doc_segmentation_fnc(msg)
-        if not isinstance(keys, list):
-            keys = [keys]
-        for k in keys:
-            segments2docs[k].append(msg)
-    sys.stderr.write('\n')
+    if tokenize_fnc is None:
+        tokenize_fnc = tokenize
+
+    if not sampling:
+        # One pass, keeping only per-segment term counts, so documents
+        # can be any iterable (e.g. corpcorp.Member.iter_messages()):
+        segments2counts, segment_sizes = segment_term_counts(documents, doc_segmentation_fnc,
+                                                             tokenize_fnc=tokenize_fnc)
+    else:
+        # Sampling needs the documents of each segment at hand:
+        segments2docs = segment_documents(documents, doc_segmentation_fnc)
 
-    # Reduce size of buckets, if desired:
-    if sampling:
         # First get rid of any buckets with insufficient docs
         segments = segments2docs.keys()
         for key in segments:
@@ -76,25 +112,100 @@ def jensen_shannon_distances(documents, doc_segmentation_fnc=lambda x: [x['frm']
             random.shuffle(messages)
             segments2docs[key] = random.sample(messages, sampsize)   
 
+        segments2counts = {key: get_term_counts(docs, tokenize_fnc=tokenize_fnc)
+                            for key, docs in segments2docs.iteritems()}
+        segment_sizes = {key: len(docs) for key, docs in segments2docs.iteritems()}
+
+    return distances_from_counts(segments2counts, segment_sizes,
+                                 liwc_map=liwc_map, vocabsize=vocabsize,
+                                 min_segment_size=min_segment_size,
+                                 matrix=matrix, condensed=condensed, vocabulary=vocabulary)
+
+
+def segment_documents(documents, doc_segmentation_fnc):
+    """Put documents into buckets that we want to compare: {segment: [docs]}"""
+    segments2docs = defaultdict(list)
+    for i, msg in enumerate(documents):
+        sys.stderr.write('\r') ; sys.stderr.write('msg %s' % i) ; sys.stderr.flush()
+        keys = doc_segmentation_fnc(msg)
+        if not isinstance(keys, list):
+            keys = [keys]
+        for k in keys:
+            segments2docs[k].append(msg)
+    sys.stderr.write('\n')
+    return segments2docs
+
+
+def segment_term_counts(documents, doc_segmentation_fnc, tokenize_fnc=None):
+    """
+    Like segment_documents, but only keeps each segment's term counts and 
+    number of documents, so documents are consumed in a single pass and 
+    each is tokenized once however many segments it belongs to.
+
+    return value:
+        ({segment: Counter of terms}, {segment: number of documents})
+    """
+    if tokenize_fnc is None:
+        tokenize_fnc = tokenize
+    segments2counts = defaultdict(Counter)
+    segment_sizes = defaultdict(int)
+    for i, msg in enumerate(documents):
+        sys.stderr.write('\r') ; sys.stderr.write('msg %s' % i) ; sys.stderr.flush()
+        keys = doc_segmentation_fnc(msg)
+        if not isinstance(keys, list):
+            keys = [keys]
+        if not keys:
+            continue
+        words = tokenize_fnc(msg['text'])
+        for k in keys:
+            segments2counts[k].update(words)
+            segment_sizes[k] += 1
+    sys.stderr.write('\n')
+    return segments2counts, segment_sizes
+
+
+def distances_from_counts(segments2counts, segment_sizes, liwc_map=False, vocabsize=1000,
+                                min_segment_size=100, matrix=False, condensed=False,
+                                vocabulary=None):
+    """
+    Second half of jensen_shannon_distances: pairwise JS distances between
+    segments given their term counts and sizes (see segment_term_counts).
+    Same kargs and return value as jensen_shannon_distances.
+    """
+    segments = segments2counts.keys()
+
     # Throw out segments with too few messages, if desired:
     if min_segment_size:
-        segments = segments2docs.keys()
-        for key in segments:
-            if len(segments2docs[key]) < min_segment_size:
+        for key in list(segments):
+            if segment_sizes[key] < min_segment_size:
                 print "Too few messages for ", key
-                del segments2docs[key]
+                segments.remove(key)
 
     # For each segment, get count distribution over terms:
     dists = {}
-    for key, docs in segments2docs.iteritems():
-        dists[key] = get_term_count_distribution(docs, vocabsize=vocabsize, liwc_map=liwc_map)
+    for key in segments:
+        dists[key] = counts_to_distribution(segments2counts[key], vocabsize=vocabsize, liwc_map=liwc_map,
+                                            vocabulary=vocabulary)
+
+    # Align all segments on one vocabulary, so that the pairwise
+    # comparisons work on term-id arrays instead of rebuilding dicts:
+    vocab = Vocabulary()
+    sparse_dists = {key: vocab.distribution(dist) for key, dist in dists.iteritems()}
 
     # Now measure pairwise distances:
     distances = {}
-    segments = sorted(segments2docs.keys())
+    segments = sorted(segments)
+    if matrix or condensed:
+        dmatrix = jensen_shannon_matrix([sparse_dists[seg] for seg in segments], len(vocab))
+        if condensed:
+            return segments, condense(dmatrix)
+        for i, seg1 in enumerate(segments):
+            for j in range(i+1, len(segments)):
+                distances[(seg1, segments[j])] = dmatrix[i, j]
+        return distances
     for i, seg1 in enumerate(segments):
         for seg2 in segments[i+1:]:
-            distances[(seg1, seg2)] = jensen_shannon(dists[seg1], dists[seg2])
+            distances[(seg1, seg2)] = sparse_jensen_shannon(sparse_dists[seg1], sparse_dists[seg2])
     return distances
 
 
@@ -103,16 +214,31 @@ def jensen_shannon_distances(documents, doc_segmentation_fnc=lambda x: [x['frm']
 # General utilities        
 
 
-def get_term_count_distribution(messages, vocabsize=1000, liwc_map=False):
-    # Flatten to a single list of words:
-    words = [w for msg in messages for w in tokenize(msg['text'])]
+def get_term_count_distribution(messages, vocabsize=1000, liwc_map=False, tokenize_fnc=None):
+    countdict = get_term_counts(messages, tokenize_fnc=tokenize_fnc)
+    return counts_to_distribution(countdict, vocabsize=vocabsize, liwc_map=liwc_map)
+
+def get_term_counts(messages, tokenize_fnc=None):
+    # Counted message by message, so memory goes with the vocabulary
+    # rather than with the number of tokens:
+    if tokenize_fnc is None:
+        tokenize_fnc = tokenize
+    countdict = Counter()
+    for msg in messages:
+        countdict.update(tokenize_fnc(msg['text']))
+    return countdict
+
+def counts_to_distribution(countdict, vocabsize=1000, liwc_map=False, vocabulary=None):
     if liwc_map:
-        # Perform the LIWC transformation:
-        words = collapse_by_liwc(words)
-    # Create count dictionary:
-    countdict = Counter(words)
-    # Vocab size restriction based on frequency:
-    countdict = dict(sorted(countdict.items(), key=itemgetter(1), reverse=True)[ : min(len(countdict), vocabsize)])
+        # Perform the LIWC transformation, weighting each distinct
+        # word's categories by its count:
+        countdict = get_liwc_index().collapse_counts(countdict)
+    if vocabulary is not None:
+        # Fixed (e.g. corpus-wide) vocabulary:
+        countdict = {term: n for term, n in countdict.iteritems() if term in vocabulary}
+    else:
+        # Vocab size restriction based on frequency:
+        countdict = top_terms(countdict, vocabsize)
     # Distribution:
     dist = counts2dist(countdict)
     return dist
@@ -121,12 +247,44 @@ def tokenize(text):
     words = TOKENIZER.tokenize(text)
     return words
 
+def tokenize_many(texts, workers=1, chunksize=64, counts=False):
+    """TOKENIZER over many texts, see tokenizers.tokenize_many."""
+    return tokenizers.tokenize_many(texts, TOKENIZER, workers=workers, chunksize=chunksize, counts=counts)
+
 def collapse_by_liwc(words):
+    return get_liwc_index().collapse(words)
+
+def collapse_by_liwc_regex(words):
+    # Reference implementation, one regex search per (category, word);
+    # same category multiset as collapse_by_liwc, kept for benchmarking.
     cats = []
-    for cat, regex in LIWC.items():
+    for cat, regex in get_liwc().items():
         cats += [cat for w in words if regex.search(w)]
     return cats
 
+def top_terms(countdict, k):
+    """
+    The k most frequent terms of countdict with their counts. Ties are
+    broken by the terms themselves, so the result does not depend on
+    dict order. A partial selection: O(V log k) rather than a full sort.
+    """
+    if len(countdict) <= k:
+        return dict(countdict)
+    return dict(heapq.nsmallest(k, countdict.iteritems(), key=lambda (term, n): (-n, term)))
+
+def global_vocabulary(counts, vocabsize=1000, liwc_map=False):
+    """
+    The vocabsize most frequent terms (LIWC categories with liwc_map)
+    over all the term Counters in counts, as a frozenset to pass as
+    the vocabulary karg of jensen_shannon_distances.
+    """
+    total = Counter()
+    for countdict in counts:
+        total.update(countdict)
+    if liwc_map:
+        total = get_liwc_index().collapse_counts(total)
+    return frozenset(top_terms(total, vocabsize))
+
 def counts2dist(countdict):
     total = float(sum(countdict.values()))
     return {key:val/total for key, val in countdict.iteritems()}
@@ -154,6 +312,149 @@ def safelog2(x):
 
 
 ######################################################################
+# Sparse distributions over a shared vocabulary
+
+
+class Vocabulary:
+    """
+    Maps terms to consecutive integer ids. Distributions built from
+    the same Vocabulary can be compared with sparse_jensen_shannon.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.terms = []
+
+    def id(self, term):
+        try:
+            return self.ids[term]
+        except KeyError:
+            self.ids[term] = len(self.terms)
+            self.terms.append(term)
+            return self.ids[term]
+
+    def distribution(self, dist):
+        """SparseDistribution for a {term: probability} dict."""
+        ids = np.fromiter((self.id(term) for term in dist), dtype=np.int64, count=len(dist))
+        values = np.fromiter(dist.itervalues(), dtype=np.float64, count=len(dist))
+        order = np.argsort(ids)
+        return SparseDistribution(ids[order], values[order])
+
+    def __len__(self):
+        return len(self.terms)
+
+
+class SparseDistribution:
+    """
+    A distribution as aligned arrays: sorted, unique term ids into a
+    Vocabulary and their (strictly positive) probabilities.
+    """
+
+    def __init__(self, ids, values):
+        self.ids = ids
+        self.values = values
+
+    def dense(self, size):
+        p = np.zeros(size)
+        p[self.ids] = self.values
+        return p
+
+    def to_dict(self, vocab):
+        return {vocab.terms[i]: val for i, val in zip(self.ids, self.values)}
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def sparse_jensen_shannon(f, g):
+    """
+    jensen_shannon for two SparseDistributions over the same Vocabulary.
+
+    With m = (p + q) / 2, a term only in p contributes p * log2(p / m) = p,
+    so only the shared terms need logarithms.
+    """
+    _, fi, gi = np.intersect1d(f.ids, g.ids, assume_unique=True, return_indices=True)
+    p = f.values[fi]
+    q = g.values[gi]
+    pq = (p + q) / 2.0
+    shared = np.sum(p * np.log2(p / pq)) + np.sum(q * np.log2(q / pq))
+    f_only = np.ones(len(f), dtype=bool)
+    f_only[fi] = False
+    g_only = np.ones(len(g), dtype=bool)
+    g_only[gi] = False
+    unshared = np.sum(f.values[f_only]) + np.sum(g.values[g_only])
+    return np.sqrt(0.5 * (shared + unshared))
+
+def jensen_shannon_matrix(dists, size, block_bytes=BLOCK_BYTES):
+    """
+    All-pairs JS distances for a list of SparseDistributions over a
+    Vocabulary of the given size, as a symmetric (n x n) array.
+
+    Rows are compared a block at a time against all later rows. Within a
+    block only the terms some block row uses need logarithms; the other
+    terms contribute just their mass, as in sparse_jensen_shannon. So
+    only those columns of the block and the later rows are densified,
+    and blocks grow while each (rows x later rows x columns) temporary
+    stays under block_bytes.
+    """
+    n = len(dists)
+    totals = np.array([dist.values.sum() for dist in dists])
+    # The rows as one flat list of (row, id, value) entries:
+    offsets = np.cumsum([0] + [len(dist) for dist in dists])
+    row_of = np.repeat(np.arange(n), np.diff(offsets))
+    ids = np.concatenate([dist.ids for dist in dists] + [np.zeros(0, dtype=np.int64)])
+    values = np.concatenate([dist.values for dist in dists] + [np.zeros(0)])
+    dmatrix = np.zeros((n, n))
+    for start, stop, cols in row_blocks(dists, block_bytes):
+        later = slice(offsets[start], offsets[-1])
+        pos = np.minimum(np.searchsorted(cols, ids[later]), max(len(cols) - 1, 0))
+        hit = cols[pos] == ids[later] if len(cols) else np.zeros(len(pos), dtype=bool)
+        dense = np.zeros((n - start, len(cols)))
+        dense[row_of[later][hit] - start, pos[hit]] = values[later][hit]
+        p = dense[:stop - start, None, :]
+        q = dense[None, :, :]
+        pq = (p + q) / 2.0
+        shared = (xlog2ratio(p, pq) + xlog2ratio(q, pq)).sum(axis=2)
+        # Terms used by no block row only count with their later-row mass:
+        unshared = totals[start:] - dense.sum(axis=1)
+        # (clipped, as rounding can leave the diagonal a hair below 0)
+        js = np.sqrt(np.maximum(0.5 * (shared + unshared), 0.0))
+        dmatrix[start:stop, start:] = js
+    dmatrix = np.triu(dmatrix, 1)
+    return dmatrix + dmatrix.T
+
+def row_blocks(dists, block_bytes):
+    """
+    (start, stop, cols) for consecutive blocks of the rows of
+    jensen_shannon_matrix, cols being the sorted term ids the block's
+    rows use. A block takes rows while its (rows x later rows x len(cols))
+    float64 temporaries stay under block_bytes, and has at least one row.
+    """
+    n = len(dists)
+    start = 0
+    while start < n:
+        cols = dists[start].ids
+        stop = start + 1
+        while stop < n:
+            merged = np.union1d(cols, dists[stop].ids)
+            if 8 * (stop + 1 - start) * (n - start) * len(merged) > block_bytes:
+                break
+            cols = merged
+            stop += 1
+        yield start, stop, cols
+        start = stop
+
+def xlog2ratio(x, y):
+    # x * log2(x / y), taking 0 * log(0) to be 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(x > 0, x * np.log2(x / y), 0.0)
+
+def condense(dmatrix):
+    """Upper triangle of a distance matrix, in pdist order."""
+    return dmatrix[np.triu_indices(len(dmatrix), 1)]
+
+
+######################################################################
 
 
 
@@ -0,0 +1,196 @@
+import re
+import sys
+import json
+import cPickle as pickle
+from collections import Counter
+
+"""
+Compiled lookup index for the LIWC dictionary.
+
+The LIWC resource is a dict mapping category names to anchored,
+case-insensitive regexes of the form ^(word|word|prefix.*|...)$.
+Matching every token against every category regex costs
+O(categories x tokens) regex evaluations; LiwcIndex instead splits
+the alternatives into
+
+    exact words -> hash lookup
+    prefix.*    -> character trie
+    anything else (e.g. "kind (of)") -> small residual regexes
+
+and memoizes the categories of each distinct word, so a word is
+resolved once per process no matter how often it occurs.
+
+Unpickling the regex dict recompiles every category regex, which makes
+it slow to load. save_table writes the split-up index as plain JSON,
+and load_table reads it back without compiling the category regexes.
+They only get compiled if a word needs the full regexes.
+
+    python liwc.py LIWC2007dictionary_regex.pickle LIWC2007dictionary_index.json
+"""
+
+# A plain dictionary entry: ASCII letters/digits/apostrophes, 
+# optionally followed by one or more .* wildcards.
+entry_re = re.compile(r"^([\w']+)((?:\.\*)+)?$")
+
+# Words the fast path can answer exactly: ASCII (so lower() agrees with
+# re.I) and without newlines (which '.' and '$' treat specially; \Z
+# rather than $, which would let a trailing newline through).
+simple_word_re = re.compile(r"^[\x00-\x09\x0b-\x7f]*\Z")
+
+# Trie node key marking the end of a prefix entry:
+TERMINAL = None
+
+
+class LiwcIndex:
+
+    def __init__(self, liwc):
+        """liwc- dict mapping category names to compiled regexes."""
+        self.regexes = liwc
+        self.patterns = {cat: (regex.pattern, regex.flags) for cat, regex in liwc.iteritems()}
+        self.exact = {}
+        self.prefixes = {}
+        self.trie = {}
+        self.residual = []
+        self.memo = {}
+        for cat in sorted(liwc):
+            for alt in split_alternatives(liwc[cat].pattern):
+                match = entry_re.match(alt)
+                if match and liwc[cat].flags & re.I:
+                    word = match.group(1).lower()
+                    if match.group(2):
+                        self._add_prefix(word, cat)
+                    else:
+                        self.exact.setdefault(word, set()).add(cat)
+                else:
+                    self.residual.append((cat, re.compile(r"^(?:%s)$" % alt, liwc[cat].flags)))
+
+    def _add_prefix(self, prefix, cat):
+        self.prefixes.setdefault(prefix, set()).add(cat)
+        node = self.trie
+        for c in prefix:
+            node = node.setdefault(c, {})
+        node.setdefault(TERMINAL, set()).add(cat)
+
+    def categories(self, word):
+        """Tuple of the LIWC categories word belongs to, in sorted order."""
+        try:
+            return self.memo[word]
+        except KeyError:
+            pass
+        if simple_word_re.match(word):
+            cats = self._lookup(word)
+        else:
+            cats = set(cat for cat, regex in self.full_regexes().iteritems() if regex.search(word))
+        cats = tuple(sorted(cats))
+        self.memo[word] = cats
+        return cats
+
+    def _lookup(self, word):
+        lower = word.lower()
+        cats = set(self.exact.get(lower, ()))
+        node = self.trie
+        for c in lower:
+            node = node.get(c)
+            if node is None:
+                break
+            cats.update(node.get(TERMINAL, ()))
+        # The empty prefix (a bare ".*") would sit at the root:
+        cats.update(self.trie.get(TERMINAL, ()))
+        for cat, regex in self.residual:
+            if cat not in cats and regex.search(word):
+                cats.add(cat)
+        return cats
+
+    def full_regexes(self):
+        """The category regexes, compiled on first use for a loaded table."""
+        if self.regexes is None:
+            self.regexes = {cat: re.compile(pattern, flags) for cat, (pattern, flags) in self.patterns.iteritems()}
+        return self.regexes
+
+    def names(self):
+        """Sorted category names."""
+        return sorted(self.patterns)
+
+    def collapse(self, words):
+        """Map words to the flat list of their LIWC categories."""
+        categories = self.categories
+        return [cat for w in words for cat in categories(w)]
+
+    def collapse_counts(self, counts):
+        """
+        Map a {word: count} dict to a Counter of LIWC category counts,
+        equal to Counter(self.collapse(counts.elements())) but one
+        step per distinct word rather than per token.
+        """
+        categories = self.categories
+        cats = Counter()
+        for w, n in counts.iteritems():
+            if n > 0:
+                for cat in categories(w):
+                    cats[cat] += n
+        return cats
+
+
+def save_table(index, filename):
+    """Write index as the JSON table load_table reads."""
+    table = {
+        'exact': {word: sorted(cats) for word, cats in index.exact.iteritems()},
+        'prefixes': {prefix: sorted(cats) for prefix, cats in index.prefixes.iteritems()},
+        'residual': [(cat,) + pattern_to_json(regex.pattern, regex.flags) for cat, regex in index.residual],
+        'patterns': {cat: pattern_to_json(pattern, flags) for cat, (pattern, flags) in index.patterns.iteritems()},
+        }
+    with open(filename, 'wb') as outfile:
+        json.dump(table, outfile, sort_keys=True)
+
+
+def load_table(filename):
+    """LiwcIndex from a table written by save_table."""
+    with open(filename, 'rb') as infile:
+        table = json.load(infile)
+    index = LiwcIndex({})
+    index.regexes = None
+    index.patterns = {cat: pattern_from_json(*entry) for cat, entry in table['patterns'].iteritems()}
+    index.exact = {word: set(cats) for word, cats in table['exact'].iteritems()}
+    for prefix, cats in table['prefixes'].iteritems():
+        for cat in cats:
+            index._add_prefix(prefix, cat)
+    index.residual = [(entry[0], re.compile(*pattern_from_json(*entry[1:]))) for entry in table['residual']]
+    return index
+
+
+# Byte string patterns (which match differently from unicode ones outside
+# ASCII) are kept as latin-1 text in the table, and flagged as bytes:
+
+def pattern_to_json(pattern, flags):
+    if isinstance(pattern, str):
+        return (pattern.decode('latin-1'), flags, True)
+    return (pattern, flags, False)
+
+def pattern_from_json(pattern, flags, is_bytes):
+    return (pattern.encode('latin-1') if is_bytes else pattern, flags)
+
+
+def split_alternatives(pattern):
+    """
+    Split an anchored ^(a|b|c)$ pattern into its top-level alternatives.
+    """
+    if pattern.startswith("^(") and pattern.endswith(")$"):
+        pattern = pattern[2:-2]
+    alts = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(pattern):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            alts.append(pattern[start:i])
+            start = i + 1
+    alts.append(pattern[start:])
+    return alts
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'rb') as infile:
+        save_table(LiwcIndex(pickle.load(infile)), sys.argv[2])
@@ -0,0 +1,221 @@
+import sys
+import array
+from collections import defaultdict, Counter
+import numpy as np
+
+from jensen_shannon import tokenize, Vocabulary, SparseDistribution, get_liwc_index
+from jensen_shannon import sparse_jensen_shannon, jensen_shannon_matrix
+
+"""
+Bootstrap and subsample distributions of segment JS distances.
+
+jensen_shannon_distances(sampling=True) draws one sample per segment
+and tokenizes it, so confidence intervals meant rerunning everything.
+MessageCounts instead tokenizes each document once into a row of sparse
+term counts; a replicate is then a weight per document (how often it was
+drawn), and a segment's term counts are the weighted sum of its rows,
+one np.bincount over the segment's nonzeros.
+
+    counts = MessageCounts(documents, doc_segmentation_fnc)
+    distances = resampled_distances(counts, replicates=200, seed=1)
+    # {(seg1, seg2): array of 200 JS distances}
+"""
+
+
+class MessageCounts:
+
+    """
+    Term counts of each document, stored once as CSR arrays (row i's
+    term ids are indices[indptr[i]:indptr[i+1]], counts in data), and
+    the rows making up each segment.
+    """
+
+    def __init__(self, documents, doc_segmentation_fnc=lambda x: [x['frm']], tokenize_fnc=None):
+        if tokenize_fnc is None:
+            tokenize_fnc = tokenize
+        self.vocab = Vocabulary()
+        segments2rows = defaultdict(list)
+        indptr = array.array('l', [0])
+        indices = array.array('l')
+        data = array.array('l')
+        for i, msg in enumerate(documents):
+            sys.stderr.write('\r') ; sys.stderr.write('msg %s' % i) ; sys.stderr.flush()
+            keys = doc_segmentation_fnc(msg)
+            if not isinstance(keys, list):
+                keys = [keys]
+            if not keys:
+                continue
+            for term, n in Counter(tokenize_fnc(msg['text'])).iteritems():
+                indices.append(self.vocab.id(term))
+                data.append(n)
+            for k in keys:
+                segments2rows[k].append(len(indptr) - 1)
+            indptr.append(len(indices))
+        sys.stderr.write('\n')
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.data = np.array(data, dtype=np.float64)
+        self.segments = {k: np.array(rows, dtype=np.int64) for k, rows in segments2rows.iteritems()}
+        self._nonzeros = {}
+        self._liwc = None
+
+    def segment_size(self, segment):
+        return len(self.segments[segment])
+
+    def segment_counts(self, segment, weights=None):
+        """
+        Term counts of segment (an array over the vocabulary), with its
+        documents counted weights[j] times each (default: once).
+        """
+        row, indices, data = self._segment_nonzeros(segment)
+        if weights is not None:
+            data = data * weights[row]
+        return np.bincount(indices, weights=data, minlength=len(self.vocab))
+
+    def _segment_nonzeros(self, segment):
+        # The segment's nonzeros, and which of its documents each is from
+        if segment not in self._nonzeros:
+            rows = self.segments[segment]
+            starts = self.indptr[rows]
+            lengths = self.indptr[rows + 1] - starts
+            # Concatenated ranges starts[j]:starts[j]+lengths[j]
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            positions = offsets + np.arange(lengths.sum())
+            row = np.repeat(np.arange(len(rows)), lengths)
+            self._nonzeros[segment] = (row, self.indices[positions], self.data[positions])
+        return self._nonzeros[segment]
+
+    def liwc_categories(self):
+        """Sorted names of the LIWC categories of the vocabulary's terms."""
+        return self._liwc_table()[0]
+
+    def liwc_counts(self, counts):
+        """LIWC category counts (over liwc_categories()) from term counts."""
+        names, pair_terms, pair_cats = self._liwc_table()
+        return np.bincount(pair_cats, weights=counts[pair_terms], minlength=len(names))
+
+    def _liwc_table(self):
+        # (category names, term id and category id of each membership)
+        if self._liwc is None:
+            liwc_index = get_liwc_index()
+            categories = [liwc_index.categories(term) for term in self.vocab.terms]
+            names = sorted(set(cat for cats in categories for cat in cats))
+            cat_ids = {cat: i for i, cat in enumerate(names)}
+            pairs = [(i, cat_ids[cat]) for i, cats in enumerate(categories) for cat in cats]
+            self._liwc = (names, np.array([i for i, c in pairs], dtype=np.int64),
+                          np.array([c for i, c in pairs], dtype=np.int64))
+        return self._liwc
+
+    def term_ranks(self, terms):
+        """Position of each term in sorted order, for breaking count ties."""
+        ranks = np.empty(len(terms), dtype=np.int64)
+        ranks[np.array(sorted(range(len(terms)), key=terms.__getitem__), dtype=np.int64)] = np.arange(len(terms))
+        return ranks
+
+
+def top_k(counts, k, ranks):
+    """
+    Sorted ids of the k largest nonzero counts, ties going to the lower
+    rank, as top_terms does for dicts; a partial selection via
+    np.partition rather than a full sort.
+    """
+    nonzero = np.flatnonzero(counts)
+    if len(nonzero) <= k:
+        return nonzero
+    values = counts[nonzero]
+    threshold = np.partition(values, len(values) - k)[len(values) - k]
+    above = nonzero[values > threshold]
+    tied = nonzero[values == threshold]
+    tied = tied[np.argsort(ranks[tied], kind='mergesort')[:k - len(above)]]
+    return np.sort(np.concatenate([above, tied]))
+
+
+def counts_to_sparse_distribution(counts, vocabsize, ranks):
+    # (empty, rather than NaN, if there are no counts at all)
+    ids = top_k(counts, vocabsize, ranks)
+    values = counts[ids]
+    if not len(ids):
+        return SparseDistribution(ids, values)
+    return SparseDistribution(ids, values / float(values.sum()))
+
+
+def resampled_distances(message_counts, replicates=100, sampsize=None, bootstrap=True,
+                                seed=0, liwc_map=False, vocabsize=1000,
+                                min_segment_size=100, matrix=False):
+    """
+    Distributions of the pairwise JS distances between segments over
+    resampled document sets.
+
+    args:
+        message_counts- a MessageCounts
+
+    kargs:
+        replicates- number of resamples
+        sampsize- documents drawn per segment and replicate. Default:
+            the segment's own size.
+        bootstrap- draw with replacement; with False, draw sampsize
+            distinct documents (subsampling, as sampling=True in
+            jensen_shannon_distances), skipping smaller segments.
+            Subsampling needs a sampsize, as drawing all of a segment's
+            documents would give the same distances every replicate.
+        seed- seed of the numpy RandomState drawing the samples, so a
+            run can be reproduced exactly.
+        liwc_map, vocabsize, min_segment_size, matrix- as for
+            jensen_shannon_distances.
+
+    return value:
+        {(segment1, segment2): array of JS distances, one per replicate}
+        Replicates in which either segment drew no terms at all (only
+        empty documents) have no distance and are left out, so an array
+        can be shorter than replicates.
+    """
+    if not bootstrap and not sampsize:
+        raise ValueError("subsampling (bootstrap=False) needs a sampsize")
+    rng = np.random.RandomState(seed)
+    segments = sorted(message_counts.segments)
+    for key in list(segments):
+        n = message_counts.segment_size(key)
+        if n < min_segment_size or (not bootstrap and sampsize and n < sampsize):
+            print "Too few messages for ", key
+            segments.remove(key)
+
+    if liwc_map:
+        # Category ids are in name order already
+        size = len(message_counts.liwc_categories())
+        ranks = np.arange(size)
+    else:
+        size = len(message_counts.vocab)
+        ranks = message_counts.term_ranks(message_counts.vocab.terms)
+
+    pairs = [(seg1, seg2) for i, seg1 in enumerate(segments) for seg2 in segments[i+1:]]
+    distances = {pair: [] for pair in pairs}
+    for b in range(replicates):
+        dists = []
+        for key in segments:
+            weights = replicate_weights(rng, message_counts.segment_size(key), sampsize, bootstrap)
+            counts = message_counts.segment_counts(key, weights)
+            if liwc_map:
+                counts = message_counts.liwc_counts(counts)
+            dists.append(counts_to_sparse_distribution(counts, vocabsize, ranks))
+        if matrix:
+            dmatrix = jensen_shannon_matrix(dists, size)
+        for i, seg1 in enumerate(segments):
+            if not len(dists[i]):
+                continue
+            for j in range(i+1, len(segments)):
+                if not len(dists[j]):
+                    continue
+                js = dmatrix[i, j] if matrix else sparse_jensen_shannon(dists[i], dists[j])
+                distances[(seg1, segments[j])].append(js)
+    return {pair: np.array(ds) for pair, ds in distances.iteritems()}
+
+
+def replicate_weights(rng, n, sampsize=None, bootstrap=True):
+    """How often each of n documents is drawn in one replicate."""
+    if sampsize is None:
+        sampsize = n
+    if bootstrap:
+        return np.bincount(rng.randint(0, n, sampsize), minlength=n).astype(np.float64)
+    weights = np.zeros(n)
+    weights[rng.choice(n, sampsize, replace=False)] = 1.0
+    return weights
@@ -0,0 +1,65 @@
+import os
+import hashlib
+import cPickle as pickle
+
+"""
+On-disk cache of tokenized document texts.
+
+Each corpus file gets a sidecar pickle next to it, named after the file
+and the tokenizer signature, e.g.
+
+    alice_2001.json.3f2a9c01b7de.tokens
+
+Entries are keyed by a hash of the text itself, so edited or added
+messages simply miss the cache, and a tokenizer with different options
+or changed code (see tokenizers.source_digest) gets a different sidecar
+altogether.
+"""
+
+class TokenCache:
+
+    def __init__(self, filename, tokenizer):
+        self.tokenizer = tokenizer
+        self.filename = "%s.%s.tokens" % (filename, tokenizer.signature())
+        self.tokens = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'rb') as infile:
+                    self.tokens = pickle.load(infile)
+            except (EOFError, pickle.UnpicklingError):
+                # Truncated sidecar from an interrupted run, just rebuild it
+                self.tokens = {}
+        self.dirty = False
+
+    def tokenize(self, text):
+        key = text_key(text)
+        words = self.tokens.get(key)
+        if words is None:
+            self.misses += 1
+            words = self.tokenizer.tokenize(text)
+            self.tokens[key] = words
+            self.dirty = True
+        else:
+            self.hits += 1
+        return words
+
+    def save(self):
+        """Write the sidecar if anything new was tokenized."""
+        if not self.dirty:
+            return
+        # Write then rename, so readers never see a partial file
+        tmpname = "%s.%s.tmp" % (self.filename, os.getpid())
+        with open(tmpname, 'wb') as outfile:
+            pickle.dump(self.tokens, outfile, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname, self.filename)
+        self.dirty = False
+
+
+def text_key(text):
+    # str and unicode of the same characters tokenize differently
+    # (see TwitterTokenizer.tokenize), so keep them apart:
+    if isinstance(text, unicode):
+        return hashlib.sha1('u' + text.encode('utf-8')).digest()
+    return hashlib.sha1('s' + str(text)).digest()
@@ -1,27 +1,65 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import re
+import hashlib
+import datetime
+import itertools
+import multiprocessing
 import htmlentitydefs
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, Counter
 import dateutil.parser
 import sys
-import signal
 
 ######################################################################
 
 # HTML entities:
-html_entity_digit_re = re.compile(r"&#\d+;")
-html_entity_alpha_re = re.compile(r"&\w+;")
+html_entity_digit_re = re.compile(r"&#(\d+);")
+html_entity_alpha_re = re.compile(r"&(\w+);")
 amp = "&amp;"
 
+# Numeric entities that decode to '&', '#', ';' or a digit can form new
+# numeric entities as they are decoded one by one, in which case the
+# result depends on the order html2unicode_reference replaces them in:
+ambiguous_digit_entity_re = re.compile(r"&#0*(?:3[58]|59|4[89]|5[0-7]);")
+
+# Named entity -> character, for all but &amp; (which becomes " and "):
+ENTITY_CHARS = dict((name, unichr(codepoint)) for name, codepoint in htmlentitydefs.name2codepoint.iteritems()
+                    if name != 'amp')
+
+def decode_digit_entity(match):
+    try:
+        return unichr(int(match.group(1)))
+    except (ValueError, OverflowError):
+        return match.group()
+
+def decode_alpha_entity(match):
+    return ENTITY_CHARS.get(match.group(1), match.group())
+
 def html2unicode(s):
     """
     Seeks to replace all the HTML entities in s with their
     corresponding unicode characters.
     """
+    # Most texts have no entities at all:
+    if '&' not in s:
+        return s
+    # Byte strings leave entities alone where decoding would fail:
+    if not isinstance(s, unicode):
+        return html2unicode_reference(s)
+    if '&#' in s:
+        if ambiguous_digit_entity_re.search(s):
+            return html2unicode_reference(s)
+        s = html_entity_digit_re.sub(decode_digit_entity, s)
+    s = html_entity_alpha_re.sub(decode_alpha_entity, s)
+    return s.replace(amp, " and ")
+
+def html2unicode_reference(s):
+    # The original replace-per-entity version; html2unicode gives the
+    # same output, see bench_html in benchmarks.py.
     # First the digits:
-    ents = set(html_entity_digit_re.findall(s))
+    ents = set(m.group() for m in html_entity_digit_re.finditer(s))
     if len(ents) > 0:
         for ent in ents:
             entnum = ent[2:-1]
@@ -31,7 +69,7 @@ def html2unicode(s):
             except:
                 pass
     # Now the alpha versions:
-    ents = set(html_entity_alpha_re.findall(s))
+    ents = set(m.group() for m in html_entity_alpha_re.finditer(s))
     ents = filter((lambda x : x != amp), ents)
     for ent in ents:
         entname = ent[1:-1]
@@ -44,7 +82,12 @@ def html2unicode(s):
 
 ######################################################################
 
-tags = r"""<[^>]+>"""    
+# Longest tag matched. An unbounded <[^>]+> scans to the end of the text
+# from every "<" without a ">" after it, which is quadratic in text like
+# "< < < ..."; bounded, each "<" costs at most this much.
+MAX_TAG_LENGTH = 1000
+
+tags = r"""<[^>]{1,%d}>""" % MAX_TAG_LENGTH
 
 ######################################################################
 
@@ -85,12 +128,13 @@ urls = r"""
       [a-z0-9.\-]+[.][a-z]{2,4}/              # looks like domain name followed by a slash
     )
     (?:                                       # One or more:
-      [^\s()<>]+                              # Run of non-space, non-()<>
+      [^\s()<>]                               # Non-space, non-()<> (one at a time: a run
+                                              # inside this + backtracks exponentially)
       |                                       #   or
-      \((?:[^\s()<>]+|(?:\([^\s()<>]+\)))*\)  # balanced parens, up to 2 levels
+      \((?:[^\s()<>]|(?:\([^\s()<>]+\)))*\)   # balanced parens, up to 2 levels
     )+
     (?:                                       # End with:
-      \((?:[^\s()<>]+|(?:\([^\s()<>]+\)))*\)  # balanced parens, up to 2 levels
+      \((?:[^\s()<>]|(?:\([^\s()<>]+\)))*\)   # balanced parens, up to 2 levels
       |                                       # or
       [^\s`!()\[\]{};:'".,<>?«»“”‘’]           # not a space or one of these punct chars
      )
@@ -381,13 +425,151 @@ class WhitespaceTokenizer:
 
 ######################################################################
 
-class TimeoutException(Exception): 
-    pass
+# Longest run of non-whitespace handed to word_re in one piece. Matching
+# within a run can cost up to quadratic time in its length, so longer runs
+# (base64 blobs, mangled URLs) are broken up with spaces before matching.
+MAX_RUN_LENGTH = 500
+
+long_run_re = re.compile(r"\S{%d,}" % (MAX_RUN_LENGTH + 1), re.UNICODE)
+
+def split_long_runs(s):
+    """s with every MAX_RUN_LENGTH-long piece of a longer run of non-whitespace set apart."""
+    return long_run_re.sub(
+        lambda m: u" ".join(m.group()[i : i+MAX_RUN_LENGTH] for i in xrange(0, len(m.group()), MAX_RUN_LENGTH)),
+        s)
+
+######################################################################
+# Date normalization. Email bodies repeat a few date strings endlessly,
+# so normalized forms are kept in a bounded LRU cache, and the plain
+# numeric and month-name formats are parsed directly; dateutil only sees
+# the rest. In tokenize the cache sits behind TokenPipeline's memo of
+# whole tokens, and keeps dates across the memo being cleared at
+# MAX_MEMO or rebuilt for new options.
+
+DATE_CACHE_SIZE = 10000
+
+digit_re = re.compile(r"\d")
+
+numeric_mdy_re = re.compile(r"^(\d{1,2})([/.-])(\d{1,2})\2(\d{4})$")
+numeric_ymd_re = re.compile(r"^(\d{4})([/.-])(\d{1,2})\2(\d{1,2})$")
+day_month_year_re = re.compile(r"^(\d{1,2})\s+([a-z]+)\.?\s+(\d{4})$", re.I)
+month_day_year_re = re.compile(r"^([a-z]+)\.?,?\s+(\d{1,2}),?\s+(\d{4})$", re.I)
+month_day_re = re.compile(r"^([a-z]+)\.?\s+(\d{1,2})$", re.I)
+day_month_re = re.compile(r"^(\d{1,2})\s+([a-z]+)\.?$", re.I)
+
+MONTH_NAMES = {}
+for i, name in enumerate(('january', 'february', 'march', 'april', 'may', 'june', 'july',
+                          'august', 'september', 'october', 'november', 'december')):
+    MONTH_NAMES[name] = MONTH_NAMES[name[:3]] = i + 1
+MONTH_NAMES['sept'] = 9
+
+def fast_parse_date(s):
+    """
+    datetime for s if it is one of the common date formats, read the way
+    dateutil.parser would read it (month first unless the first number
+    can't be a month), else None.
+    """
+    match = numeric_mdy_re.match(s)
+    if match:
+        first, second, year = int(match.group(1)), int(match.group(3)), int(match.group(4))
+        if first > 12 and second > 12:
+            return None
+        month, day = (first, second) if first <= 12 else (second, first)
+        return make_date(year, month, day)
+    match = numeric_ymd_re.match(s)
+    if match:
+        year, _, month, day = match.groups()
+        return make_date(int(year), int(month), int(day))
+    match = day_month_year_re.match(s)
+    if match:
+        day, month, year = match.groups()
+        return make_date(int(year), MONTH_NAMES.get(month.lower()), int(day))
+    match = month_day_year_re.match(s)
+    if match:
+        month, day, year = match.groups()
+        return make_date(int(year), MONTH_NAMES.get(month.lower()), int(day))
+    match = month_day_re.match(s) or day_month_re.match(s)
+    if match:
+        month, day = match.groups() if match.re is month_day_re else reversed(match.groups())
+        month = MONTH_NAMES.get(month.lower())
+        # dateutil fills in the current year, which decides whether Feb 29 exists:
+        if month == 2 and int(day) == 29:
+            return None
+        return make_date(2000, month, int(day))
+    return None
+
+def make_date(year, month, day):
+    # None (fall back to dateutil) for anything not obviously a valid date
+    if month is None or not 1 <= month <= 12 or year < 1900:
+        return None
+    try:
+        return datetime.datetime(year, month, day)
+    except ValueError:
+        return None
+
+class LRUCache:
+
+    """Bounded mapping that evicts the least recently used key."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, key):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self.data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.data.pop(key, None)
+        if len(self.data) >= self.maxsize:
+            self.data.popitem(last=False)
+        self.data[key] = value
+
+    def __len__(self):
+        return len(self.data)
+
+######################################################################
+
+_source_digest = None
 
-def timeout_handler(signum, frame):
-    raise TimeoutException()    
+def source_digest():
+    """
+    sha1 of this module's source, so that any edit to the tokenizer
+    changes TwitterTokenizer.signature() without a VERSION bump; of its
+    regex patterns if only the compiled module is around.
+    """
+    global _source_digest
+    if _source_digest is None:
+        source = os.path.splitext(__file__)[0] + '.py'
+        if os.path.isfile(source):
+            with open(source, 'rb') as infile:
+                text = infile.read()
+        else:
+            text = repr(sorted((name, value.pattern) for name, value in globals().items()
+                               if isinstance(value, type(word_re))))
+        _source_digest = hashlib.sha1(text).hexdigest()
+    return _source_digest
 
 class TwitterTokenizer:
+    # Constructor options, in signature order:
+    OPTIONS = ('preserve_case', 'preserve_all_caps', 'filter_html_tags',
+               'filter_twitter_usernames', 'filter_twitter_hashtags',
+               'filter_urls', 'filter_dates', 'filter_nonsentiment_punctuation',
+               'mark_negation_scope', 'mark_quotation_scope',
+               'mark_nonveridical_scope', 'porter_stem',
+               'normalize_dates', 'normalize_elongations')
+    # Part of signature(), along with the module source; bump it for
+    # changes elsewhere that alter tokenize() output:
+    VERSION = 2
+
     def __init__(self,
                 preserve_case=True,
                 preserve_all_caps=True,
@@ -418,8 +600,63 @@ class TwitterTokenizer:
         self.porter_stem = porter_stem
         self.normalize_dates = normalize_dates
         self.normalize_elongations = normalize_elongations
+        # Number of texts that had long runs split up before matching:
+        self.split_texts = 0
+        self._compiled = None
+        # Normalized form of recently seen date-like tokens:
+        self.date_cache = LRUCache(DATE_CACHE_SIZE)
+        self.dates_parsed = 0
+        self.date_fallbacks = 0
+
+    def signature(self):
+        """
+        Short digest of VERSION, the option set and the tokenizer code
+        (see source_digest); two tokenizers with the same signature
+        produce the same tokens for the same text.
+        """
+        options = [(opt, getattr(self, opt)) for opt in TwitterTokenizer.OPTIONS]
+        return hashlib.sha1(repr((TwitterTokenizer.VERSION, options, source_digest()))).hexdigest()[:12]
 
     def tokenize(self, s):
+        words = self._words(s)
+        pipeline = self._pipeline()
+        transform = pipeline.transform
+        negation, nonveridical, quotation, punctuation = pipeline.scopes
+        negating = intensional = quoting = False
+        tokens = []
+        for word in words:
+            word = transform(word)
+            if word is None:
+                continue
+            # Negation:
+            if negation:
+                if negation_regex.search(word):
+                    negating = True
+                elif scope_close_re.search(word) or emoticon_re.search(word):
+                    negating = False
+                elif negating:
+                    word = word + "_NEG"
+            # Nonveridical:
+            if nonveridical:
+                if nonveridical_regex.search(word):
+                    intensional = True
+                elif scope_close_re.search(word) or emoticon_re.search(word):
+                    intensional = False
+                elif intensional and not word.endswith("_QUOTE"):
+                    word = word + "_QUOTE"
+            # Quotation:
+            if quotation:
+                if quotation_regex.search(word):
+                    quoting = not quoting
+                elif quoting and not word.endswith("_QUOTE"):
+                    word = word + "_QUOTE"
+            # Nonsentiment punctuation:
+            if punctuation and not (emoticon_re.search(word) or not nonsentiment_punctuation_re.search(word)):
+                continue
+            tokens.append(word)
+        return tokens
+
+    def _words(self, s):
         # Try to ensure unicode:
         try:
             s = unicode(s)
@@ -428,17 +665,31 @@ class TwitterTokenizer:
             s = unicode(s)
         # Fix HTML character entitites:
         s = html2unicode(s)
-
-        old_handler = signal.signal(signal.SIGALRM, timeout_handler)
-        secs = int(round(1 + (len(s)/200000.0), 0))
-        signal.alarm(secs) # triger alarm in 3 seconds
-        try:
-            words = word_re.findall(s)
-        except TimeoutException:
-            return []
-        finally:
-            signal.signal(signal.SIGALRM, old_handler) 
-            signal.alarm(0)
+        # Bound the matching time on pathological input:
+        if len(s) > MAX_RUN_LENGTH and long_run_re.search(s):
+            s = split_long_runs(s)
+            self.split_texts += 1
+        return word_re.findall(s)
+
+    def _pipeline(self):
+        # Options are plain attributes that callers may change,
+        # so look the pipeline up by their current values:
+        options = tuple(getattr(self, opt) for opt in TwitterTokenizer.OPTIONS)
+        if self._compiled is None or self._compiled.options != options:
+            self._compiled = TokenPipeline(self, options)
+        return self._compiled
+
+    def __getstate__(self):
+        # The pipeline holds lambdas; workers rebuild it on first use.
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        return state
+
+    def tokenize_reference(self, s):
+        # The original one-transform-per-pass tokenize, kept as the
+        # reference the differential test in tests/test_tokenizers.py
+        # runs against.
+        words = self._words(s)
         # Case:
         if not self.preserve_case:
             if self.preserve_all_caps:
@@ -505,21 +756,156 @@ class TwitterTokenizer:
         return words
 
     def date_normalizer(self, s):
+        # Every date pattern needs a digit; most tokens have none.
+        if not digit_re.search(s):
+            return s
+        try:
+            return self.date_cache[s]
+        except KeyError:
+            pass
+        normalized = self._normalize_date(s)
+        self.date_cache[s] = normalized
+        return normalized
+
+    def _normalize_date(self, s):
         if long_date_re.search(s):
-            try:
-               dt = dateutil.parser.parse(s)
-               return dt.strftime('%b_%d_%Y')
-            except:
-               return s            
+            fmt = '%b_%d_%Y'
         elif short_date_re.search(s):
+            fmt = '%b_%d'
+        else:
+            return s
+        self.dates_parsed += 1
+        dt = fast_parse_date(s)
+        if dt is None:
+            self.date_fallbacks += 1
             try:
                dt = dateutil.parser.parse(s)
-               return dt.strftime('%b_%d')
             except:
-               return s            
-        else:
+               return s
+        try:
+            return dt.strftime(fmt)
+        except ValueError:
             return s
-        
+
+    def date_stats(self):
+        """
+        Hit/miss counts of the date cache (lookups of date-like tokens
+        the token memo didn't have), the tokens actually parsed, and how
+        many of those needed dateutil.
+        """
+        cache = self.date_cache
+        lookups = cache.hits + cache.misses
+        return {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache),
+                'hit_rate': float(cache.hits) / lookups if lookups else 0.0,
+                'dates_parsed': self.dates_parsed, 'dateutil_fallbacks': self.date_fallbacks}
+
+class TokenPipeline:
+
+    """
+    The per-token transforms and filters enabled for a TwitterTokenizer,
+    composed once. A token's fate before the scope marking (case, the
+    filters, date normalization, elongation, stemming) depends on the
+    token alone, so transform() memoizes it and each distinct token goes
+    through the regexes only once.
+    """
+
+    # Memo entries kept before starting over:
+    MAX_MEMO = 200000
+
+    def __init__(self, tokenizer, options):
+        self.options = options
+        steps = []
+        if not tokenizer.preserve_case:
+            if tokenizer.preserve_all_caps:
+                steps.append(lambda x : x if all_caps_re.search(x) or emoticon_re.search(x) else x.lower())
+            else:
+                steps.append(lambda x : x if emoticon_re.search(x) else x.lower())
+        if tokenizer.filter_html_tags:
+            steps.append(lambda x : None if html_tag_re.search(x) else x)
+        if tokenizer.filter_twitter_usernames:
+            steps.append(lambda x : None if twitter_usename_re.search(x) else x)
+        if tokenizer.filter_twitter_hashtags:
+            steps.append(lambda x : None if twitter_hashtag_re.search(x) else x)
+        if tokenizer.filter_urls:
+            steps.append(lambda x : None if url_re.search(x) else x)
+        if tokenizer.normalize_dates:
+            steps.append(tokenizer.date_normalizer)
+        if tokenizer.filter_dates:
+            steps.append(lambda x : None if long_date_re.search(x) or short_date_re.search(x) else x)
+        if tokenizer.normalize_elongations:
+            steps.append(lambda x : elongation_re.sub(r"\1\1\1", x))
+        if tokenizer.porter_stem:
+            from nltk.stem.porter import PorterStemmer
+            stemmer = PorterStemmer()
+            steps.append(stemmer.stem)
+        self.steps = steps
+        self.scopes = (tokenizer.mark_negation_scope, tokenizer.mark_nonveridical_scope,
+                       tokenizer.mark_quotation_scope, tokenizer.filter_nonsentiment_punctuation)
+        self.memo = {}
+
+    def transform(self, word):
+        """word after all the enabled per-token steps, or None if filtered out."""
+        try:
+            return self.memo[word]
+        except KeyError:
+            pass
+        result = word
+        for step in self.steps:
+            result = step(result)
+            if result is None:
+                break
+        if len(self.memo) >= TokenPipeline.MAX_MEMO:
+            self.memo.clear()
+        self.memo[word] = result
+        return result
+
+######################################################################
+# Batch tokenization
+
+def tokenize_many(texts, tokenizer=None, workers=1, chunksize=64, counts=False):
+    """
+    Tokenize each of texts, yielding the token lists in input order.
+
+    kargs:
+    tokenizer- anything with a tokenize method (default: TwitterTokenizer())
+    workers- with more than 1, texts are streamed through a process pool
+      of that size; the tokenizer is sent to each worker once, when it starts
+    chunksize- texts sent to a worker at a time
+    counts- yield a Counter of each text's tokens instead of the list,
+      which is much less to send back from the workers
+    """
+    if tokenizer is None:
+        tokenizer = TwitterTokenizer()
+    if workers <= 1:
+        for result in itertools.imap(_tokenize_fnc(tokenizer, counts), texts):
+            yield result
+        return
+    pool = multiprocessing.Pool(workers, _init_tokenize_worker, (tokenizer, counts))
+    try:
+        for result in pool.imap(_tokenize_in_worker, texts, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+# Per-process state of tokenize_many:
+_worker_tokenize = None
+
+def _init_tokenize_worker(tokenizer, counts):
+    global _worker_tokenize
+    _worker_tokenize = _tokenize_fnc(tokenizer, counts)
+
+def _tokenize_fnc(tokenizer, counts):
+    if counts:
+        return lambda text: Counter(tokenizer.tokenize(text))
+    return tokenizer.tokenize
+
+def _tokenize_in_worker(text):
+    return _worker_tokenize(text)
+
 ######################################################################
 
 if __name__ == '__main__':
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The tests import this checkout as the acculturation package, so the
+# directory it sits in has to be importable:
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from acculturation.experiments.corpcorp.member_distances import Checkpoint
+
+KEY = ('_member_distances', 'settings')
+RESULTS = [('alice', {'alice': 0.0, 'bob@corp.com': 0.25, u'zed@x.com': 0.5}),
+           ('bob', {(2001, 3): {'bob': 0.125, 'other': 0.75}})]
+
+
+def write_checkpoint(filename):
+    with Checkpoint(filename, KEY) as checkpoint:
+        for i, result in enumerate(RESULTS):
+            checkpoint.append('member%s.json' % i, result)
+    return open(filename, 'rb').read()
+
+
+def test_resumes_after_a_torn_record(tmpdir):
+    filename = str(tmpdir.join('checkpoint'))
+    data = write_checkpoint(filename)
+    # Cut the file anywhere within the last record:
+    with Checkpoint(filename + '.one', KEY) as checkpoint:
+        checkpoint.append('member0.json', RESULTS[0])
+    first = os.path.getsize(filename + '.one')
+    for cut in range(first, len(data)):
+        with open(filename, 'wb') as outfile:
+            outfile.write(data[:cut])
+        with Checkpoint(filename, KEY) as checkpoint:
+            assert checkpoint.done == {'member0.json': RESULTS[0]}
+            assert os.path.getsize(filename) == first
+    with Checkpoint(filename, KEY) as checkpoint:
+        checkpoint.append('member1.json', RESULTS[1])
+    assert open(filename, 'rb').read() == data
+
+
+def test_torn_header_raises(tmpdir):
+    filename = str(tmpdir.join('checkpoint'))
+    data = write_checkpoint(filename)
+    with open(filename, 'wb') as outfile:
+        outfile.write(data[:5])
+    with pytest.raises(ValueError):
+        Checkpoint(filename, KEY)
+    assert open(filename, 'rb').read() == data[:5]
+
+
+def test_other_settings_raise(tmpdir):
+    filename = str(tmpdir.join('checkpoint'))
+    write_checkpoint(filename)
+    with pytest.raises(ValueError):
+        Checkpoint(filename, KEY + ('more',))
+
+
+def test_close(tmpdir):
+    checkpoint = Checkpoint(str(tmpdir.join('checkpoint')), KEY)
+    checkpoint.close()
+    assert checkpoint.outfile.closed
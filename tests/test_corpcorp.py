@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+import pytest
+
+from acculturation.experiments.corpcorp.corpcorp import iter_json_array
+
+
+ELEMENTS = [
+    {'from': u"Zoë <zoe@corp.com>", 'subject': u"Re: [draft], v2 ]] ,,", 'body': u"naïve café — 日本語 ✓"},
+    {'body': u"quote \" and backslash \\ and ], [, {, } inside", 'to': [u"a@b.c", u"]", u","]},
+    [1, -2.5e-3, 1e10, True, False, None, u"", [], {}],
+    123456789,
+    u"€ plain string ending in a bracket ]",
+    {'nested': [[[u"]", [u","]]]], 'n': 0.0},
+]
+
+
+def encodings():
+    """The same array as json.dump would write it, and squeezed or padded."""
+    yield json.dumps(ELEMENTS)
+    yield json.dumps(ELEMENTS, ensure_ascii=False).encode('utf-8')
+    yield json.dumps(ELEMENTS, indent=4, ensure_ascii=False).encode('utf-8')
+    yield json.dumps(ELEMENTS, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    yield "\n [ \n" + ",\r\n\t".join(json.dumps(e, ensure_ascii=False).encode('utf-8') for e in ELEMENTS) + " ] \n"
+    yield "[]"
+    yield " [ 7 ] "
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 3, 7, 64, 2 ** 16])
+def test_matches_json_loads(chunksize):
+    for data in encodings():
+        assert list(iter_json_array(io.BytesIO(data), chunksize=chunksize)) == json.loads(data)
+
+
+def test_truncated_arrays():
+    data = json.dumps(ELEMENTS, ensure_ascii=False).encode('utf-8')
+    for cut in (len(data) - 1, len(data) // 2, 1):
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.BytesIO(data[:cut]), chunksize=3))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.BytesIO('{"not": "an array"}')))
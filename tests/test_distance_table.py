@@ -0,0 +1,37 @@
+import numpy as np
+
+from acculturation.experiments.corpcorp import distance_table
+
+
+def table():
+    results = [('alice', {(2001, 1): {'alice': 0.0, 'bob': 0.5}, (2001, 2): {'bob': 0.25}}, None),
+               ('bob', {(2001, 1): {'alice': 0.5}}, None),
+               ('carol', {(2001, 3): {'bob': 0.125, 'dave': 0.375}}, None)]
+    return distance_table.monthly_table(results)
+
+
+def test_split_by_user():
+    months = table()
+    departed = months.user_mask(set(['bob', 'carol', 'nobody']))
+    groups = {'living': months.select(~departed), 'departed': months.select(departed)}
+    assert groups['living'].user_means() == {'alice': (0.25 + 0.25) / 2}
+    assert groups['departed'].user_means() == {'bob': 0.5, 'carol': 0.25}
+    assert sorted(groups['departed'].trajectories()) == ['bob', 'carol']
+    assert len(groups['living']) + len(groups['departed']) == len(months)
+
+
+def test_user_mask_of_empty_table():
+    empty = distance_table.monthly_table([])
+    assert len(empty.user_mask(set(['alice']))) == 0
+
+
+def test_to_dict_round_trip():
+    months = table()
+    assert months.to_dict()['alice'] == {(2001, 1): {'alice': 0.0, 'bob': 0.5}, (2001, 2): {'bob': 0.25}}
+    assert np.all(months.month_index() >= 2001 * 12)
+
+
+def test_to_dict_leaves_out_empty_months():
+    months = distance_table.monthly_table([('alice', {(2001, 1): {'bob': 0.5}, (2001, 2): {}}, None),
+                                           ('bob', {(2001, 1): {}}, None)])
+    assert months.to_dict() == {'alice': {(2001, 1): {'bob': 0.5}}}
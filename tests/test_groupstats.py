@@ -0,0 +1,58 @@
+import numpy as np
+from scipy.stats import mannwhitneyu
+
+from acculturation.experiments.corpcorp import groupstats
+
+
+def tied_samples(n=20, seed=0):
+    """Pairs of samples drawn from few values, so that most values tie."""
+    rng = np.random.RandomState(seed)
+    samples = []
+    for _ in range(n):
+        levels = rng.randint(2, 8)
+        x = rng.randint(0, levels, rng.randint(3, 40)) / 4.0
+        y = rng.randint(0, levels, rng.randint(3, 40)) / 4.0 + rng.choice([0, 0.25])
+        samples.append((x, y))
+    return samples
+
+
+def test_u_test_matches_scipy_on_ties():
+    for x, y in tied_samples():
+        u, pvals, effects = groupstats.u_test(x, y)
+        expected = mannwhitneyu(x, y, alternative='two-sided')
+        assert np.allclose(u[0], expected.statistic)
+        assert np.allclose(pvals[0], expected.pvalue)
+        assert np.allclose(effects[0], expected.statistic / float(len(x) * len(y)))
+
+
+def test_coded_u_matches_scipy_on_ties():
+    for x, y in tied_samples():
+        xcodes, ycodes, ncodes = groupstats.pooled_codes(x, y)
+        u, ties = groupstats.coded_u(xcodes[None, :], ycodes[None, :], ncodes)
+        u, pvals, effects = groupstats.u_pvalues(u, ties, len(x), len(y))
+        expected = mannwhitneyu(x, y, alternative='two-sided')
+        assert np.allclose(u[0], expected.statistic)
+        assert np.allclose(pvals[0], expected.pvalue)
+
+
+def test_rows_match_scipy():
+    rng = np.random.RandomState(0)
+    x = rng.randint(0, 5, (6, 12)) / 2.0
+    y = rng.randint(0, 5, (6, 9)) / 2.0
+    u, pvals, effects = groupstats.u_test(x, y)
+    for row in range(6):
+        expected = mannwhitneyu(x[row], y[row], alternative='two-sided')
+        assert np.allclose((u[row], pvals[row]), expected)
+
+
+def test_resampling_is_seeded():
+    rng = np.random.RandomState(2)
+    x = rng.randint(0, 6, 30) / 2.0
+    y = rng.randint(1, 7, 25) / 2.0
+    for fnc in (lambda seed: groupstats.permutation_pvalue(x, y, permutations=500, seed=seed),
+                lambda seed: groupstats.bootstrap_effect(x, y, resamples=500, seed=seed),
+                lambda seed: groupstats.subsample_tests(x, y, 5, resamples=500, seed=seed)):
+        assert repr(fnc(0)) == repr(fnc(0))
+        assert repr(fnc(0)) != repr(fnc(1))
+    stats = groupstats.compare_groups(x, y, sampsize=5, permutations=200, bootstrap=200, seed=3)
+    assert stats == groupstats.compare_groups(x, y, sampsize=5, permutations=200, bootstrap=200, seed=3)
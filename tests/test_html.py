@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from acculturation.lingdistance.tokenizers import html2unicode, html2unicode_reference
+
+# Entities, entity fragments and characters that entities decode to
+# (&#38; is "&", &#35; "#", &#59; ";", &#48;-&#57; digits):
+PIECES = [u"&amp;", u"&lt;", u"&gt;", u"&quot;", u"&nbsp;", u"&eacute;", u"&hellip;", u"&#39;",
+          u"&#8217;", u"&#38;", u"&#038;", u"&#35;", u"&#59;", u"&#0059;", u"&#49;", u"&#55;",
+          u"&#99999999;", u"&#0;", u"&bogus;", u"&AMP;", u"&", u"#", u";", u"amp", u"lt", u"12",
+          u"3", u" ", u"a", u"\xe9", u"\n"]
+
+EDGE_CASES = [u"", u"&", u"&;", u"&#;", u"&#38;amp;", u"&#38;#38;", u"&&amp;amp;", u"&amp;lt;",
+              u"&#38;#59;", u"&#0038;#0038;", u"AT&amp;T", u"&eacute;t&eacute;", u"&#8217;s"]
+
+
+def entity_strings(n=5000, seed=0):
+    rng = random.Random(seed)
+    return [u"".join(rng.choice(PIECES) for _ in range(rng.randint(1, 12))) for _ in range(n)]
+
+
+@pytest.mark.parametrize('text', EDGE_CASES)
+def test_edge_cases_match_reference(text):
+    assert html2unicode(text) == html2unicode_reference(text)
+
+
+def test_generated_match_reference():
+    for text in entity_strings():
+        assert html2unicode(text) == html2unicode_reference(text), text
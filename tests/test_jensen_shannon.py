@@ -0,0 +1,64 @@
+from collections import Counter
+
+import numpy as np
+
+from acculturation.lingdistance import jensen_shannon
+
+
+def random_dists(n=30, nterms=200, seed=0):
+    """n {term: probability} dicts over overlapping random supports, some tiny."""
+    rng = np.random.RandomState(seed)
+    dists = []
+    for i in range(n):
+        support = rng.choice(nterms, size=rng.randint(1, nterms // 4), replace=False)
+        weights = rng.gamma(0.5, size=len(support)) + 1e-12
+        dists.append({u"w%s" % t: w / weights.sum() for t, w in zip(support, weights)})
+    # Identical, disjoint and single-term distributions:
+    dists += [dict(dists[0]), {u"only": 1.0}, {u"w0": 1.0}]
+    return dists
+
+
+def test_sparse_matches_dict():
+    dists = random_dists()
+    vocab = jensen_shannon.Vocabulary()
+    sparse = [vocab.distribution(d) for d in dists]
+    for i in range(len(dists)):
+        for j in range(len(dists)):
+            expected = jensen_shannon.jensen_shannon(dists[i], dists[j])
+            assert abs(jensen_shannon.sparse_jensen_shannon(sparse[i], sparse[j]) - expected) < 1e-12
+
+
+def test_matrix_matches_pairwise():
+    dists = random_dists(seed=1)
+    vocab = jensen_shannon.Vocabulary()
+    sparse = [vocab.distribution(d) for d in dists]
+    expected = [jensen_shannon.sparse_jensen_shannon(sparse[i], sparse[j])
+                for i in range(len(sparse)) for j in range(i + 1, len(sparse))]
+    # One row per block, a few rows per block, and one block:
+    for block_bytes in (1, 200000, jensen_shannon.BLOCK_BYTES):
+        dmatrix = jensen_shannon.jensen_shannon_matrix(sparse, len(vocab), block_bytes=block_bytes)
+        assert np.allclose(jensen_shannon.condense(dmatrix), expected, rtol=0, atol=1e-12)
+        assert np.all(np.diag(dmatrix) == 0) and np.all(dmatrix == dmatrix.T)
+
+
+def test_row_blocks_sized_from_columns():
+    dists = [jensen_shannon.SparseDistribution(np.array([i]), np.array([1.0])) for i in range(10)]
+    blocks = list(jensen_shannon.row_blocks(dists, 8 * 2 * 10 * 2))
+    # 2 rows x 10 later rows x 2 columns fits, 3 x 10 x 3 doesn't:
+    assert [(start, stop) for start, stop, cols in blocks][:1] == [(0, 2)]
+    assert [stop - start for start, stop, cols in blocks][-1] >= 1
+    assert sum(stop - start for start, stop, cols in blocks) == 10
+
+
+def test_streamed_counts_match_flattened():
+    # get_term_count_distribution as it was: every token of the segment
+    # in one list, and with LIWC every category occurrence in another.
+    rng = np.random.RandomState(2)
+    words = u"i you not never happy sad angry work family friend think said meeting the a".split()
+    docs = [{'text': u" ".join(rng.choice(words, rng.randint(0, 30)))} for _ in range(200)]
+    for liwc_map in (False, True):
+        flat = [w for msg in docs for w in jensen_shannon.tokenize(msg['text'])]
+        if liwc_map:
+            flat = jensen_shannon.collapse_by_liwc(flat)
+        expected = jensen_shannon.counts_to_distribution(Counter(flat), vocabsize=10)
+        assert jensen_shannon.get_term_count_distribution(docs, vocabsize=10, liwc_map=liwc_map) == expected
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import random
+import cPickle as pickle
+
+import pytest
+
+from acculturation.lingdistance import jensen_shannon
+from acculturation.lingdistance.liwc import LiwcIndex, load_table, split_alternatives
+
+
+@pytest.fixture(scope='module')
+def regexes():
+    with open(jensen_shannon.LIWC_PICKLE, 'rb') as infile:
+        return pickle.load(infile)
+
+
+def liwc_words(regexes, n=3000, seed=0):
+    """Dictionary entries, their prefixes and extensions, in various cases, plus oddities."""
+    rng = random.Random(seed)
+    entries = sorted(set(alt for regex in regexes.values() for alt in split_alternatives(regex.pattern)))
+    words = [u"", u"'", u"don't", u"kind of", u"kind", u"caf\xe9", u"\xfcber", u"na\xefve",
+             u"I", u"i", u"HAPPY", u"happ\ny", u"happy\n", u"’s", u"2001", u"a b"]
+    for _ in range(n):
+        word = rng.choice(entries).replace(u".*", u"")
+        word = word[:rng.randint(max(1, len(word) - 2), len(word))] if word else word
+        word += rng.choice([u"", u"", u"s", u"ing", u"ly", u"\xe9", u"'"])
+        word = rng.choice([word, word.upper(), word.capitalize()])
+        words.append(word if rng.random() < 0.9 else word.encode('utf-8'))
+    return words
+
+
+@pytest.mark.parametrize('source', ['table', 'pickle'])
+def test_index_matches_regexes(regexes, source):
+    index = load_table(jensen_shannon.LIWC_TABLE) if source == 'table' else LiwcIndex(regexes)
+    for word in liwc_words(regexes):
+        expected = tuple(sorted(cat for cat, regex in regexes.iteritems() if regex.search(word)))
+        assert index.categories(word) == expected, word
+
+
+def test_collapse_matches_reference(regexes):
+    words = liwc_words(regexes, n=500, seed=1)
+    assert sorted(jensen_shannon.collapse_by_liwc(words)) == sorted(jensen_shannon.collapse_by_liwc_regex(words))
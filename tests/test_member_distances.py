@@ -0,0 +1,111 @@
+import os
+import json
+import random
+
+import pytest
+
+from acculturation.experiments.corpcorp import member_distances
+
+WORDS = u"i you we not never happy sad work family friend think said meeting the a project deal".split()
+SENDERS = [u"Alice <alice@corp.com>", u"\"Alice A\" <Alice@corp.com>", u"Bob <bob@corp.com>",
+           u"bob@corp.com", u"\"Zed X\" <zed@x.com>", u"Zed <zed@x.com>", u"Mallory <mallory@y.org>"]
+
+
+def write_member(path, username, n=60, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for i in range(n):
+        messages.append({'from': rng.choice(SENDERS), 'to': u"%s@corp.com" % username,
+                         'date': u"Mon, %s Mar 2001 10:00:00 -0700" % rng.randint(1, 28),
+                         'subject': u"hi", 'message-id': u"<%s.%s@x>" % (username, i),
+                         'body': u" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))})
+    with open(path, 'wb') as outfile:
+        json.dump(messages, outfile)
+
+
+@pytest.fixture
+def corpus(tmpdir):
+    for seed, username in enumerate(['alice', 'bob']):
+        write_member(str(tmpdir.join('%s_2001.json' % username)), username, seed=seed)
+    return str(tmpdir)
+
+
+def counting_calls(monkeypatch):
+    calls = []
+    count = member_distances._member_segment_counts
+    def counted(task):
+        calls.append(task[0])
+        return count(task)
+    monkeypatch.setattr(member_distances, '_member_segment_counts', counted)
+    return calls
+
+
+def test_counts_file_reused_until_a_file_changes(corpus, tmpdir, monkeypatch):
+    counts_file = str(tmpdir.join('counts.pickle'))
+    calls = counting_calls(monkeypatch)
+    first = member_distances.get_segment_counts(corpus, counts_file=counts_file)
+    assert len(calls) == 2
+    assert member_distances.get_segment_counts(corpus, counts_file=counts_file) == first
+    assert len(calls) == 2
+    # Same name, new contents:
+    write_member(os.path.join(corpus, 'bob_2001.json'), 'bob', n=80, seed=5)
+    changed = member_distances.get_segment_counts(corpus, counts_file=counts_file)
+    assert len(calls) == 4
+    assert changed['bob'] != first['bob']
+
+
+def test_sweep_results_are_separate(corpus):
+    counts = member_distances.get_segment_counts(corpus)
+    sweep = member_distances.sweep_distances(counts, vocabsizes=(100, 500), min_segment_size=1)
+    assert sweep[(True, 100)] == sweep[(True, 500)]
+    assert sweep[(True, 100)] is not sweep[(True, 500)]
+    sweep[(True, 100)]['alice'].clear()
+    assert sweep[(True, 500)]['alice']
+
+
+def append_mail(path, n=30, seed=7):
+    # New mail in a month already seen and in a new one
+    rng = random.Random(seed)
+    with open(path, 'rb') as infile:
+        messages = json.load(infile)
+    for i in range(n):
+        messages.append({'from': rng.choice(SENDERS), 'to': messages[0]['to'],
+                         'date': u"Tue, %s %s 2001 10:00:00 -0700" % (rng.randint(1, 28), rng.choice(["Mar", "Apr"])),
+                         'subject': u"re: hi", 'message-id': u"<new.%s@x>" % i,
+                         'body': u" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))})
+    with open(path, 'wb') as outfile:
+        json.dump(messages, outfile)
+
+
+def assert_close(results, expected):
+    # (counts are summed in another order, so distances can differ in the last bits)
+    assert sorted(results) == sorted(expected)
+    for key, value in expected.iteritems():
+        if isinstance(value, dict):
+            assert_close(results[key], value)
+        else:
+            assert results[key] == pytest.approx(value, rel=0, abs=1e-12)
+
+
+@pytest.mark.parametrize('monthly', [False, True])
+def test_incremental_distances_match_a_full_run(corpus, tmpdir, monkeypatch, monthly):
+    write_member(os.path.join(corpus, 'zed_2001.json'), 'zed', seed=2)
+    state_dir = str(tmpdir.join('state'))
+    full_run = member_distances.get_monthly_distances if monthly else member_distances.get_distances
+    kargs = dict(min_segment_size=1)
+    calls = counting_calls(monkeypatch)
+    first = member_distances.get_incremental_distances(corpus, state_dir, monthly=monthly, **kargs)
+    assert_close(first, full_run(corpus, **kargs))
+    assert sorted(first) == ['alice', 'bob', 'zed'] and all(first.values())
+
+    append_mail(os.path.join(corpus, 'alice_2001.json'))
+    os.remove(os.path.join(corpus, 'bob_2001.json'))
+    del calls[:]
+    second = member_distances.get_incremental_distances(corpus, state_dir, monthly=monthly, **kargs)
+    # Only alice was counted again
+    assert len(calls) == 1
+    assert_close(second, full_run(corpus, **kargs))
+    assert sorted(second) == ['alice', 'zed']
+    assert second['alice'] != first['alice'] and second['zed'] == first['zed']
+    if monthly:
+        assert sorted(second['alice']) == [(2001, 3), (2001, 4)]
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from acculturation.lingdistance.jensen_shannon import segment_term_counts, distances_from_counts
+from acculturation.lingdistance.resampling import MessageCounts, resampled_distances
+
+
+def documents():
+    words = u"happy sad work family meeting angry money deal".split()
+    docs = [{'frm': 'a', 'text': u" ".join(words[i % 8:i % 8 + 3])} for i in range(10)]
+    docs += [{'frm': 'b', 'text': u" ".join(words[i % 5:i % 5 + 4])} for i in range(10)]
+    # Mostly empty messages, so some replicates draw nothing but those:
+    docs += [{'frm': 'c', 'text': u""} for _ in range(4)] + [{'frm': 'c', 'text': u"never"}]
+    return docs
+
+
+def test_replicates_without_terms_are_left_out():
+    counts = MessageCounts(documents())
+    distances = resampled_distances(counts, replicates=50, min_segment_size=1)
+    assert len(distances[('a', 'b')]) == 50
+    assert 0 < len(distances[('a', 'c')]) < 50
+    assert len(distances[('a', 'c')]) == len(distances[('b', 'c')])
+    assert not any(np.isnan(ds).any() for ds in distances.values())
+
+
+def test_subsampling_needs_a_sampsize():
+    counts = MessageCounts(documents())
+    with pytest.raises(ValueError):
+        resampled_distances(counts, bootstrap=False, min_segment_size=1)
+    distances = resampled_distances(counts, replicates=20, bootstrap=False, sampsize=5, min_segment_size=1)
+    assert len(set(distances[('a', 'b')])) > 1
+
+
+def equal_segments():
+    # Three segments of 10 documents each, with uneven term counts so
+    # that a small vocabsize cuts through ties
+    words = u"happy sad work family meeting angry money deal love hate".split()
+    docs = []
+    for k, frm in enumerate('abd'):
+        for i in range(10):
+            docs.append({'frm': frm, 'text': u" ".join(words[(i * (k + 1)) % 10:(i * (k + 1)) % 10 + 1 + i % 4])})
+    return docs
+
+
+@pytest.mark.parametrize('liwc_map', [False, True])
+@pytest.mark.parametrize('vocabsize', [1000, 3])
+def test_subsampling_everything_matches_distances_from_counts(liwc_map, vocabsize):
+    docs = equal_segments()
+    counts = MessageCounts(docs)
+    distances = resampled_distances(counts, replicates=3, bootstrap=False, sampsize=10,
+                                    liwc_map=liwc_map, vocabsize=vocabsize, min_segment_size=1)
+    segments2counts, segment_sizes = segment_term_counts(docs, lambda x: [x['frm']])
+    expected = distances_from_counts(segments2counts, segment_sizes, liwc_map=liwc_map,
+                                     vocabsize=vocabsize, min_segment_size=1)
+    assert sorted(distances) == sorted(expected)
+    for pair, js in expected.iteritems():
+        assert np.allclose(distances[pair], [js] * 3, rtol=0, atol=1e-12)
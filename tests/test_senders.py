@@ -0,0 +1,40 @@
+from acculturation.experiments.corpcorp import member_distances
+from acculturation.experiments.corpcorp.senders import SenderIndex, canonical_email
+
+HEADERS = [u"alice <alice@corp.com>", u"Alice <Alice@corp.com>", u"ALICE@CORP.COM", u"\"Alice A\" <aa@corp.com>",
+           u"malice@evil.org", u"alice", u"Bob <bob@corp.com>", u"bob@corp.com", u"\"bob\" <robert@x.com>",
+           u"\"Zed X\" <zed@x.com>", u"Zed <zed@x.com>", u"zed@x.com", u"", u"undisclosed-recipients:;"]
+
+
+class Msg:
+    def __init__(self, frm):
+        self.frm = frm
+
+
+class FakeMember:
+    def __init__(self, username):
+        self.username = username
+
+
+def test_userlevel_assignments_unchanged():
+    # The rule before addresses were normalized: the username, as is, in the raw header
+    for username in ('alice', 'bob', 'zed', 'Alice'):
+        fnc = member_distances.get_userlevel_segmentation_fnc(FakeMember(username))
+        for header in HEADERS * 2:
+            expected = [username] if username in header else ["other"]
+            assert fnc(Msg(header)) == expected, (username, header)
+
+
+def test_dyadic_segments_keyed_by_address():
+    fnc = member_distances.get_dyadic_segmentation_fnc(FakeMember('alice'))
+    assert fnc(Msg(u"alice <alice@corp.com>")) == ['alice']
+    assert fnc(Msg(u"Alice <Alice@corp.com>")) == [u'alice@corp.com']
+    assert fnc(Msg(u"\"Zed X\" <zed@x.com>")) == fnc(Msg(u"Zed <zed@x.com>")) == fnc(Msg(u"zed@x.com")) == [u'zed@x.com']
+
+
+def test_sender_ids():
+    senders = SenderIndex()
+    ids = [senders.sender_id(header) for header in HEADERS]
+    assert ids[9] == ids[10] == ids[11]
+    assert senders.email(ids[6]) == u'bob@corp.com' == canonical_email(HEADERS[7])
+    assert len(senders) == len(set(canonical_email(header) for header in HEADERS))
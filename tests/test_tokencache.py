@@ -0,0 +1,19 @@
+from acculturation.lingdistance import tokenizers
+from acculturation.lingdistance.tokencache import TokenCache
+
+
+def test_signature_covers_tokenizer_source(monkeypatch):
+    tok = tokenizers.TwitterTokenizer()
+    signature = tok.signature()
+    monkeypatch.setattr(tokenizers, '_source_digest', 'edited')
+    assert tok.signature() != signature
+
+
+def test_sidecar_named_after_signature(tmpdir):
+    tok = tokenizers.TwitterTokenizer()
+    filename = str(tmpdir.join('alice_2001.json'))
+    cache = TokenCache(filename, tok)
+    assert cache.tokenize(u"Hello there") == tok.tokenize(u"Hello there")
+    cache.save()
+    assert cache.filename == "%s.%s.tokens" % (filename, tok.signature())
+    assert TokenCache(filename, tok).tokens == cache.tokens
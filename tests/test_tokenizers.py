@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import re
+import time
+import random
+
+from acculturation.lingdistance import tokenizers
+from acculturation.lingdistance.tokenizers import TwitterTokenizer
+
+
+# word_re as it was before tags were bounded:
+ORIGINAL_WORD_RE = re.compile(r"""(%s)""" % "|".join((r"<[^>]+>",) + tokenizers.regex_strings[1:]),
+                              re.VERBOSE | re.I | re.UNICODE)
+
+LINES = [u"Hi all,", u"", u"Following up on the <a\nhref='http://example.com/q?x=1'>report</a> from",
+         u"October 12, 2001 and the call on Jan 5,", u"2002 -- please see <b>below</b>.",
+         u"Call me at (555) 123-4567 or\n555 987 6543 if anything is unclear.",
+         u"<table style='border: 1px solid; padding: 4px'><tr><td>Q3</td><td>$5,000.00</td></tr></table>",
+         u"We would've met on 12/25/2001 but NOT on 3/4 :) ... thanks!!!", u"> quoted: never again",
+         u"-----Original Message-----", u"From: Alice <alice@corp.com>", u"Sent: Friday, October 12,",
+         u"2001 10:30 AM", u"if x < y and y > z, then <i>maybe</i> so"]
+
+
+def email_texts(n=100, seed=0):
+    """Multi-line bodies of 1000-5000 characters, tags and dates often at line breaks."""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        lines = []
+        while sum(len(line) + 1 for line in lines) < rng.randint(1000, 5000):
+            lines.append(rng.choice(LINES))
+        texts.append(u"\n".join(lines))
+    return texts
+
+
+def test_words_match_original_on_long_emails():
+    tok = TwitterTokenizer()
+    for text in email_texts():
+        assert tok._words(text) == ORIGINAL_WORD_RE.findall(text)
+    assert tok.split_texts == 0
+
+
+def test_unclosed_tags_stay_linear():
+    # "<" starts the tag alternative, which scanned ahead for ">" to the
+    # end of the text: about 10s here before tags were bounded.
+    tok = TwitterTokenizer()
+    start = time.time()
+    words = tok.tokenize(u"< " * 20000)
+    assert time.time() - start < 3.0
+    assert words == [u"<"] * 20000
+    assert tok.split_texts == 0
+
+
+def test_long_tags_are_not_tags():
+    tag = u"<a href='%s'>" % (u"x" * tokenizers.MAX_TAG_LENGTH)
+    assert tokenizers.word_re.findall(u"see " + tag)[1] == u"<"
+
+
+def test_long_runs_are_split():
+    tok = TwitterTokenizer()
+    start = time.time()
+    words = tok.tokenize(u"<" * 100000)
+    assert time.time() - start < 3.0
+    assert u"".join(words) == u"<" * 100000
+    assert tok.split_texts == 1
+
+
+######################################################################
+# tokenize against tokenize_reference
+
+PIECES = [u"I", u"did", u"NOT", u"like", u"it", u"never", u"nothing", u"if", u"would've", u"maybe",
+          u"GREAT", u"sooooo", u"hmmmmm", u"!!!", u"...", u". . .", u";", u",", u"--", u"?", u"\"", u"'",
+          u"’quote’", u"“quoted”", u":)", u":-(", u";P", u"(:", u"<3", u"&lt;3",
+          u"&amp;", u"&eacute;t&eacute;", u"&#8217;", u"&nbsp;", u"<b>", u"</b>", u"<a href='x'>",
+          u"@alice", u"#friday", u"##tag-line", u"http://example.com/a_(b)", u"www.foo.org", u"foo.com/x",
+          u"e-mail", u"alice@corp.com", u"$5.99", u"10:30", u"3/4", u"12/25/2001", u"2001-12-25",
+          u"25 Dec 2001", u"Jan 5, 2002", u"January 5 2002", u"Sept. 9", u"9 Sep", u"555-123-4567",
+          u"(555) 123 4567", u"h/t", u"caf\xe9", u"\xfcber", u"RE:", u"fwd", u"\n", u"\n\n", u"  ", u"\t"]
+
+EDGE_CASES = [u"", u" ", u"\n", u":)", u"not :) happy", u"\"never\" again \"", u"&amp;&amp;",
+              u"Jan 5, 2002", u"Jan 55, 2002", u"13/13/2013", u"02/29/2001", u"0/0/00",
+              u"x" * 1200, u"a" + u"<" * 1200 + u" b", (u"Jan 5 " * 300).strip(), u"< " * 600,
+              "plain bytes", "caf\xc3\xa9", "\xff\xfe bad bytes"]
+
+
+def generated_texts(n=150, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        pieces = [rng.choice(PIECES) for _ in range(rng.randint(1, 40))]
+        if rng.random() < 0.05:
+            # A long run, or a long text, for the matching guards:
+            pieces.append(rng.choice([u"A" * 700, u"x y " * 400]))
+        texts.append(u"".join(piece + rng.choice([u" ", u" ", u""]) for piece in pieces))
+    return texts
+
+
+def option_combinations(n=16, seed=0):
+    """All options off, all on, each on alone, and n random combinations."""
+    options = [opt for opt in TwitterTokenizer.OPTIONS if opt != 'porter_stem']
+    rng = random.Random(seed)
+    combos = [dict.fromkeys(options, False), dict.fromkeys(options, True)]
+    combos += [dict(dict.fromkeys(options, False), **{opt: True}) for opt in options]
+    combos += [{opt: rng.random() < 0.5 for opt in options} for _ in range(n)]
+    return combos
+
+
+def test_tokenize_matches_reference():
+    texts = EDGE_CASES + generated_texts()
+    for options in option_combinations():
+        tok = TwitterTokenizer(**options)
+        for text in texts:
+            assert tok.tokenize(text) == tok.tokenize_reference(text), (options, text)
+
+
+def test_options_changed_after_first_use():
+    tok = TwitterTokenizer()
+    text = u"I did NOT like <b>it</b> on Jan 5, 2002 :) sooooo"
+    tok.tokenize(text)
+    tok.preserve_case = False
+    tok.normalize_dates = True
+    tok.mark_negation_scope = True
+    assert tok.tokenize(text) == tok.tokenize_reference(text)
+
+
+######################################################################
+# Date normalization
+
+def date_strings(n=3000, seed=0):
+    rng = random.Random(seed)
+    months = [u"Jan", u"Feb", u"feb.", u"Sept", u"Sep", u"September", u"DEC", u"Mai", u"Foo"]
+    dates = []
+    for _ in range(n):
+        day, month, year = rng.randint(0, 35), rng.randint(0, 14), rng.choice([99, 1899, 1999, 2001, 2004, 2100])
+        sep = rng.choice(u"/-.")
+        name = rng.choice(months)
+        dates.append(rng.choice([
+            u"%s%s%s%s%s" % (month, sep, day, sep, year),
+            u"%s%s%s%s%s" % (year, sep, month, sep, day),
+            u"%s %s %s" % (day, name, year),
+            u"%s %s, %s" % (name, day, year),
+            u"%s %s" % (name, day),
+            u"%s %s" % (day, name)]))
+    return dates
+
+
+def test_fast_parse_date_matches_dateutil():
+    import dateutil.parser
+    for s in date_strings():
+        dt = tokenizers.fast_parse_date(s)
+        if dt is None:
+            continue
+        parsed = dateutil.parser.parse(s)
+        if len(s.split()) == 2:
+            # Month and day only: dateutil fills in the current year
+            assert (dt.month, dt.day) == (parsed.month, parsed.day), s
+        else:
+            assert dt.date() == parsed.date(), s
+
+
+def test_date_cache_outlives_the_memo():
+    tok = TwitterTokenizer(normalize_dates=True)
+    text = u"due 12/25/2001 or Jan 5, 2002, not 12/25/2001"
+    for _ in range(10):
+        tok.tokenize(text)
+    # Repeats are answered by the token memo; the cache sees each date once:
+    stats = tok.date_stats()
+    assert (stats['misses'], stats['hits'], stats['dates_parsed']) == (2, 0, 2)
+    assert len(tok.date_cache) == 2
+    # After the memo is cleared (or rebuilt for other options), dates
+    # come from the cache rather than being parsed again:
+    tok._pipeline().memo.clear()
+    tok.mark_negation_scope = True
+    assert tok.tokenize(text) == tok.tokenize_reference(text)
+    stats = tok.date_stats()
+    assert stats['dates_parsed'] == 2 and stats['hits'] >= 2